@@ -0,0 +1,173 @@
+import io
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from datetime import date
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import RealDictCursor, execute_values
+
+logger = logging.getLogger(__name__)
+
+
+class PoolExhausted(Exception):
+    """No connection became free within the checkout timeout."""
+
+
+class DBPool:
+    """Thread-safe PostgreSQL connection pool shared by all request handlers.
+
+    Wraps psycopg2's ThreadedConnectionPool, which raises as soon as every
+    connection is checked out, with a semaphore so callers wait up to
+    ``timeout`` seconds instead. Connections idle for longer than
+    ``health_check_interval`` are pinged before being handed out and replaced
+    if the server has dropped them. ``statement_timeout`` (ms) is set per
+    session, so a runaway query cannot hold a pooled connection forever.
+    """
+
+    def __init__(self, config, minconn=1, maxconn=10, statement_timeout=30000,
+                 timeout=5.0, health_check_interval=30.0):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._pool = ThreadedConnectionPool(
+            minconn, maxconn,
+            **{k: v for k, v in config.items() if v is not None},
+            options=f"-c statement_timeout={int(statement_timeout)}",
+            cursor_factory=RealDictCursor,
+        )
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}  # id(conn) -> time it was last returned
+        self.in_use = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.health_failures = 0
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        last = self._last_used.get(id(conn))
+        if last is None or time.monotonic() - last < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self):
+        while True:
+            conn = self._pool.getconn()
+            if self._healthy(conn):
+                return conn
+            logger.warning("Discarding broken pooled database connection")
+            with self._lock:
+                self.health_failures += 1
+                self._last_used.pop(id(conn), None)
+            self._pool.putconn(conn, close=True)
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of the block.
+
+        Whatever the block leaves uncommitted is rolled back before the
+        connection goes back to the pool.
+        """
+        start = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.waits += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self.timeouts += 1
+                raise PoolExhausted(f"No database connection free after {self.timeout}s")
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self.wait_total += time.monotonic() - start
+        broken = False
+        try:
+            yield conn
+        finally:
+            try:
+                if not conn.closed:
+                    conn.rollback()
+            except psycopg2.Error:
+                broken = True
+            broken = broken or bool(conn.closed)
+            with self._lock:
+                self.in_use -= 1
+                if broken:
+                    self._last_used.pop(id(conn), None)
+                else:
+                    self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn, close=broken)
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "in_use": self.in_use,
+                "open": len(self._pool._pool) + len(self._pool._used),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "wait_total": self.wait_total,
+                "health_failures": self.health_failures,
+            }
+
+    def close(self):
+        self._pool.closeall()
+
+
+def _csv_field(value):
+    # COPY csv: an unquoted empty field is NULL, a quoted one is an empty string
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def bulk_insert(cur, table, columns, rows, page_size=1000):
+    """Insert ``rows`` (tuples in ``columns`` order) and return how many were written.
+
+    Rows are streamed with a single ``COPY ... FROM STDIN``. If the server
+    refuses COPY, the same rows go in through ``execute_values`` instead;
+    either way nothing is returned per row.
+    """
+    if not rows:
+        return 0
+    cols = sql.SQL(", ").join(map(sql.Identifier, columns))
+    copy = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(sql.Identifier(table), cols)
+    buf = io.StringIO("".join(",".join(map(_csv_field, row)) + "\n" for row in rows))
+    # a failed COPY aborts the transaction, so it runs inside a savepoint the fallback can rewind to
+    cur.execute("SAVEPOINT bulk_copy")
+    try:
+        cur.copy_expert(copy.as_string(cur), buf)
+    except psycopg2.Error as e:
+        cur.execute("ROLLBACK TO SAVEPOINT bulk_copy")
+        logger.warning(f"COPY into {table} failed, falling back to execute_values: {e}")
+        insert = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(sql.Identifier(table), cols)
+        execute_values(cur, insert.as_string(cur), rows, page_size=page_size)
+    else:
+        cur.execute("RELEASE SAVEPOINT bulk_copy")
+    return len(rows)
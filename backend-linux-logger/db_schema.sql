@@ -1,24 +1,35 @@
+-- Mouse and keystroke events are range-partitioned on event_time. The API creates
+-- one partition per day or week (PARTITION_INTERVAL) ahead of time and on demand,
+-- and PARTITION_RETENTION_DAYS drops whole partitions instead of deleting rows.
+-- The primary key has to include the partition column.
+--
+-- CREATE TABLE IF NOT EXISTS leaves tables from before partitioning as plain
+-- tables; convert them with `python migrate_partitions.py`, then restart the API.
+-- Until then the API inserts into them as before, without partitions or retention.
+
 -- Mouse events table
 CREATE TABLE IF NOT EXISTS mouse_events (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     event_time TIMESTAMP NOT NULL,
     event_type VARCHAR(20) NOT NULL,
     x INTEGER,
     y INTEGER,
     interval FLOAT,
     device_fingerprint VARCHAR(64),
-    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, event_time)
+) PARTITION BY RANGE (event_time);
 
 -- Keystroke events table
 CREATE TABLE IF NOT EXISTS keystroke_events (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     event_time TIMESTAMP NOT NULL,
     key_pressed VARCHAR(50) NOT NULL,
     interval FLOAT,
     device_fingerprint VARCHAR(64),
-    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, event_time)
+) PARTITION BY RANGE (event_time);
 
 -- System info table
 CREATE TABLE IF NOT EXISTS system_info (
@@ -58,4 +69,14 @@ CREATE TABLE IF NOT EXISTS voice_events (
     sample_rate INTEGER,
     device_fingerprint VARCHAR(64),
     recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
\ No newline at end of file
+);
+
+-- (time, id) keyset pagination on the listing endpoints, with and without a device filter;
+-- indexes on the partitioned tables are created on every partition automatically
+CREATE INDEX IF NOT EXISTS idx_mouse_events_time ON mouse_events (event_time, id);
+CREATE INDEX IF NOT EXISTS idx_mouse_events_device_time ON mouse_events (device_fingerprint, event_time, id);
+CREATE INDEX IF NOT EXISTS idx_keystroke_events_time ON keystroke_events (event_time, id);
+CREATE INDEX IF NOT EXISTS idx_keystroke_events_device_time ON keystroke_events (device_fingerprint, event_time, id);
+CREATE INDEX IF NOT EXISTS idx_system_info_time ON system_info (recorded_time, id);
+CREATE INDEX IF NOT EXISTS idx_usb_events_time ON usb_events (event_time, id);
+CREATE INDEX IF NOT EXISTS idx_voice_events_time ON voice_events (event_time, id);
@@ -7,6 +7,8 @@ from pathlib import Path
 import requests
 from typing import Optional, List, Dict, Any, DefaultDict, Union
 from collections import defaultdict
+from tailer import FileTailer, create_watcher
+from spool import CheckpointStore, Spool, SENT, RETRY, REJECTED
 
 # Configuration
 LOG_DIR = "/var/log/linux-agent/"
@@ -18,11 +20,17 @@ LOG_FILES = {
     "voice_monitor.log": "voice"
 }
 API_BASE_URL = "http://localhost:8000"
-CHECK_INTERVAL = 5  # seconds between file checks
+CHECK_INTERVAL = 5  # seconds between file checks when inotify is unavailable
+RESCAN_INTERVAL = 60  # with inotify, full re-check as a safety net
 BATCH_INTERVAL = 180  # 3 minutes in seconds
 MAX_RETRIES = 3
 API_TIMEOUT = 30  # Increased timeout for large batches
 MAX_BATCH_SIZE = 100  # Maximum number of items per API call
+MAX_BUFFERED_EVENTS = 10000  # flush early once this many events are held in memory
+STATE_DIR = os.path.expanduser("~/.log-monitor")  # read checkpoints and the offline spool
+SPOOL_MAX_BYTES = 64 * 1024 * 1024  # oldest unsent batches are dropped beyond this
+SPOOL_RETRY_INTERVAL = 30  # seconds between attempts to replay the spool while offline
+DEAD_LETTER_MAX_BYTES = 16 * 1024 * 1024  # batches the API rejected, kept for inspection up to this
 
 # Robust logging setup
 logging.basicConfig(
@@ -36,8 +44,9 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class BatchProcessor:
-    def __init__(self):
+    def __init__(self, spool: Spool):
         self.batches = defaultdict(list)
+        self.spool = spool
         self.last_flush_time = time.time()
     
     def add_to_batch(self, log_type: str, data: Any):
@@ -46,38 +55,52 @@ class BatchProcessor:
             self.batches[log_type].extend(data)
         else:
             self.batches[log_type].append(data)
+
+    def pending(self) -> int:
+        return sum(len(batch) for batch in self.batches.values())
     
     def should_flush(self) -> bool:
         """Check if it's time to flush batches"""
-        return time.time() - self.last_flush_time >= BATCH_INTERVAL
+        return (time.time() - self.last_flush_time >= BATCH_INTERVAL
+                or self.pending() >= MAX_BUFFERED_EVENTS)
     
     def flush_all(self, sender) -> bool:
-        """Flush all batches to their respective APIs"""
-        success = True
+        """Send all batches, spooling to disk whatever cannot be sent.
+
+        Returns True when every batched event has been sent or spooled, i.e.
+        nothing is held only in memory any more.
+        """
+        # older spooled events go first; if they have to be retried, so do these
+        online = self.spool.replay(sender)
+        retained = defaultdict(list)
         for log_type, batch in self.batches.items():
-            if batch:
-                if log_type == "system":
-                    # System info must be sent individually
-                    for item in batch:
-                        logger.info(f"Flushing system info")
-                        if not sender(log_type, [item]):  # Wrap in list for consistency
-                            success = False
-                else:
-                    # Split large batches into smaller chunks
-                    for i in range(0, len(batch), MAX_BATCH_SIZE):
-                        chunk = batch[i:i + MAX_BATCH_SIZE]
-                        logger.info(f"Flushing batch of {len(chunk)} {log_type} events")
-                        if not sender(log_type, chunk):
-                            success = False
-                            break
-        if success:
-            self.batches.clear()
-            self.last_flush_time = time.time()
-        return success
+            if log_type == "system":
+                # System info must be sent individually
+                chunks = [[item] for item in batch]
+            else:
+                # Split large batches into smaller chunks
+                chunks = [batch[i:i + MAX_BATCH_SIZE] for i in range(0, len(batch), MAX_BATCH_SIZE)]
+            for chunk in chunks:
+                if online:
+                    logger.info(f"Flushing batch of {len(chunk)} {log_type} events")
+                    result = sender(log_type, chunk)
+                    if result == SENT:
+                        continue
+                    if result == REJECTED:
+                        self.spool.reject(log_type, chunk)
+                        continue
+                    online = False
+                if not self.spool.append(log_type, chunk):
+                    retained[log_type].extend(chunk)
+        self.batches = retained
+        self.last_flush_time = time.time()
+        return not retained
 
 class LogMonitor:
     def __init__(self):
-        self.file_positions = {}
+        self.tailers = {}  # log_path -> FileTailer
+        os.makedirs(STATE_DIR, exist_ok=True)
+        self.checkpoints = CheckpointStore(os.path.join(STATE_DIR, "checkpoints.json"))
         self.session = requests.Session()
         self.session.headers.update({'Content-Type': 'application/json'})
         self.endpoint_mapping = {
@@ -87,7 +110,11 @@ class LogMonitor:
             "usb": "usb-events/",
             "voice": "voice-events/"
         }
-        self.batch_processor = BatchProcessor()
+        self.batch_processor = BatchProcessor(Spool(
+            os.path.join(STATE_DIR, "spool"), SPOOL_MAX_BYTES,
+            dead_letter=os.path.join(STATE_DIR, "dead_letter.jsonl"),
+            dead_letter_max_bytes=DEAD_LETTER_MAX_BYTES,
+        ))
 
     def parse_json_log_line(self, line: str) -> Optional[Dict[str, Any]]:
         """Improved JSON parser with timestamp handling"""
@@ -308,8 +335,13 @@ class LogMonitor:
             logger.warning(f"Unexpected error parsing voice event: {str(e)}")
             return None
 
-    def send_to_api(self, endpoint: str, data: Any) -> bool:
-        """Robust API sender with retries and validation"""
+    def send_to_api(self, endpoint: str, data: Any) -> str:
+        """Robust API sender with retries and validation.
+
+        Returns SENT, RETRY (network errors and 5xx, still failing after
+        MAX_RETRIES attempts) or REJECTED (the batch itself is unacceptable:
+        nothing valid to send, or a 4xx response), which is not retried.
+        """
         url = f"{API_BASE_URL}/{endpoint}"
 
         for attempt in range(MAX_RETRIES):
@@ -320,14 +352,14 @@ class LogMonitor:
                 sanitized_data = self.sanitize_event_data(data)
                 if not sanitized_data:
                     logger.error("No valid data to send after sanitization")
-                    return False
+                    return REJECTED
 
                 # Special handling for system info (single item only)
                 if endpoint == "system-info/":
                     if isinstance(sanitized_data, list):
                         if len(sanitized_data) != 1:
                             logger.error("system-info/ endpoint only accepts one record at a time")
-                            return False
+                            return REJECTED
                         sanitized_data = sanitized_data[0]  # Unwrap list
 
                 # Wrap list for usb-events endpoint
@@ -348,11 +380,14 @@ class LogMonitor:
                         else len(sanitized_data)
                     )
                     logger.info(f"Successfully sent batch of {count} items to {endpoint}")
-                    return True
+                    return SENT
 
                 # Detailed error logging
                 if response.status_code == 422:
-                    error_detail = response.json().get('detail', 'No details')
+                    try:
+                        error_detail = response.json().get('detail', 'No details')
+                    except ValueError:
+                        error_detail = response.text
                     logger.error(f"Validation error for {endpoint}: {error_detail}")
 
                     problem_item = (
@@ -366,6 +401,10 @@ class LogMonitor:
                 else:
                     logger.error(f"API error {response.status_code}: {response.text}")
 
+                # 4xx means the batch itself is wrong; only throttling is worth retrying
+                if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+                    return REJECTED
+
                 if response.status_code >= 500:
                     time.sleep(1)  # Wait before retrying server errors
 
@@ -376,103 +415,112 @@ class LogMonitor:
                 time.sleep(1)  # Wait before next retry
 
         logger.error(f"Failed after {MAX_RETRIES} attempts to send to {endpoint}")
-        return False
+        return RETRY
 
     def monitor_file(self, log_path: str, log_type: str):
-        """Robust file monitoring with position tracking"""
+        """Parse and batch the lines appended to one log since the last call"""
+        tailer = self.tailers.get(log_path)
+        if tailer is None:
+            # resume after the last line that was sent or spooled
+            inode, offset = self.checkpoints.get(log_path)
+            tailer = self.tailers[log_path] = FileTailer(log_path, inode, offset)
         try:
-            current_size = os.path.getsize(log_path)
-            last_position = self.file_positions.get(log_path, 0)
-            
-            # Handle log rotation
-            if current_size < last_position:
-                logger.info(f"Log rotation detected for {log_path}")
-                last_position = 0
-            
-            if current_size == last_position:
-                return  # No new data
-            
-            with open(log_path, 'r') as f:
-                f.seek(last_position)
-                new_lines = f.readlines()
-                self.file_positions[log_path] = f.tell()
-                
-                for line in new_lines:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    
-                    try:
-                        parsed_data = None
-                        
-                        if log_type == "mouse":
-                            parsed_data = self.parse_mouse_log(line)
-                        elif log_type == "keystroke":
-                            parsed_data = self.parse_keystroke_log(line)
-                        elif log_type == "system":
-                            parsed_data = self.parse_system_log(line)
-                        elif log_type == "usb":
-                            parsed_data = self.parse_usb_log(line)
-                        elif log_type == "voice":
-                            parsed_data = self.parse_voice_log(line)
-                        
-                        if parsed_data:
-                            sanitized_data = self.sanitize_event_data(parsed_data)
-                            if sanitized_data:
-                                self.batch_processor.add_to_batch(log_type, sanitized_data)
-                            
-                    except Exception as e:
-                        logger.error(f"Line processing failed: {str(e)}")
-                        
-        except FileNotFoundError:
-            logger.warning(f"File not found: {log_path}")
+            new_lines = tailer.poll()
         except Exception as e:
             logger.error(f"File monitoring error: {str(e)}")
-            self.file_positions[log_path] = 0  # Reset on error
+            tailer.close()
+            return
+
+        for line in new_lines:
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                parsed_data = None
+
+                if log_type == "mouse":
+                    parsed_data = self.parse_mouse_log(line)
+                elif log_type == "keystroke":
+                    parsed_data = self.parse_keystroke_log(line)
+                elif log_type == "system":
+                    parsed_data = self.parse_system_log(line)
+                elif log_type == "usb":
+                    parsed_data = self.parse_usb_log(line)
+                elif log_type == "voice":
+                    parsed_data = self.parse_voice_log(line)
+
+                if parsed_data:
+                    sanitized_data = self.sanitize_event_data(parsed_data)
+                    if sanitized_data:
+                        self.batch_processor.add_to_batch(log_type, sanitized_data)
+
+            except Exception as e:
+                logger.error(f"Line processing failed: {str(e)}")
+
+    def send_batch(self, log_type: str, data: Any) -> str:
+        return self.send_to_api(self.endpoint_mapping[log_type], data)
+
+    def flush(self) -> bool:
+        """Flush batches; on success, checkpoint the read positions they were read up to"""
+        if not self.batch_processor.flush_all(self.send_batch):
+            return False
+        self.checkpoints.save({
+            path: (tailer.inode, tailer.offset)
+            for path, tailer in self.tailers.items() if tailer.inode is not None
+        })
+        return True
 
     def run(self):
         logger.info(f"Starting log monitor service with batch interval of {BATCH_INTERVAL} seconds")
+        # wakes on writes/rotations in LOG_DIR; falls back to polling every CHECK_INTERVAL
+        watcher = create_watcher(LOG_DIR, CHECK_INTERVAL)
         try:
+            changed = None  # None: check every file
+            last_rescan = time.time()
+            retry_at = 0.0  # after a failed flush, when to try again
             while True:
-                start_time = time.time()
-                
-                # Check all log files for new data
+                # Read whatever was appended to the files that changed
                 for log_file, log_type in LOG_FILES.items():
+                    if changed is not None and not any(name.startswith(log_file) for name in changed):
+                        continue
                     log_path = os.path.join(LOG_DIR, log_file)
-                    if os.path.exists(log_path):
-                        self.monitor_file(log_path, log_type)
-                    else:
-                        logger.debug(f"File not present: {log_path}")
-                
+                    self.monitor_file(log_path, log_type)
+
                 # Check if it's time to flush batches
-                if self.batch_processor.should_flush():
+                if self.batch_processor.should_flush() and time.time() >= retry_at:
                     logger.info("Batch interval reached, flushing all batches")
-                    self.batch_processor.flush_all(
-                        lambda log_type, data: self.send_to_api(
-                            self.endpoint_mapping[log_type], 
-                            data
-                        )
-                    )
-                
-                # Precise timing control
-                elapsed = time.time() - start_time
-                sleep_time = max(0, CHECK_INTERVAL - elapsed)
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-                    
+                    if not self.flush():
+                        retry_at = time.time() + CHECK_INTERVAL
+                    elif self.batch_processor.spool.segments:
+                        retry_at = time.time() + SPOOL_RETRY_INTERVAL
+                elif self.batch_processor.spool.segments and time.time() >= retry_at:
+                    # offline batches are replayed as soon as the API is reachable again
+                    if not self.batch_processor.spool.replay(self.send_batch):
+                        retry_at = time.time() + SPOOL_RETRY_INTERVAL
+
+                # Sleep until a log changes, a flush or spool replay is due, or the safety rescan
+                wake_at = self.batch_processor.last_flush_time + BATCH_INTERVAL
+                if self.batch_processor.spool.segments:
+                    wake_at = min(wake_at, retry_at)
+                wake_at = min(max(wake_at, retry_at), last_rescan + RESCAN_INTERVAL)
+                changed = watcher.wait(max(wake_at - time.time(), 0.1))
+                if time.time() - last_rescan >= RESCAN_INTERVAL:
+                    changed = None
+                if changed is None:
+                    last_rescan = time.time()
+
         except KeyboardInterrupt:
             # Attempt to flush any remaining data before exiting
             logger.info("Received interrupt, attempting to flush remaining batches")
-            self.batch_processor.flush_all(
-                lambda log_type, data: self.send_to_api(
-                    self.endpoint_mapping[log_type], 
-                    data
-                )
-            )
+            self.flush()
             logger.info("Shutting down")
         except Exception as e:
             logger.error(f"Fatal error: {str(e)}")
         finally:
+            watcher.close()
+            for tailer in self.tailers.values():
+                tailer.close()
             logger.info("Log monitor stopped")
 
 if __name__ == "__main__":
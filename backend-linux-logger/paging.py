@@ -0,0 +1,68 @@
+import base64
+import json
+from datetime import date, datetime
+
+from psycopg2 import sql
+
+# Rows fetched per round-trip from a server-side cursor, and per NDJSON chunk
+STREAM_ITERSIZE = 1000
+
+
+def encode_cursor(event_time, row_id):
+    """Opaque page token for the (time, id) of the last row returned."""
+    key = json.dumps([event_time.isoformat(), row_id])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(token):
+    try:
+        event_time, row_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return datetime.fromisoformat(event_time), int(row_id)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise ValueError(f"Malformed page cursor: {token!r}")
+
+
+def events_query(table, time_column, device_fingerprint=None, since=None, until=None,
+                 cursor=None, limit=None):
+    """Newest-first SELECT over ``table`` with optional filters, resuming after ``cursor``.
+
+    Pages are cut on ``(time_column, id)`` rather than OFFSET, so every page
+    is an index range scan no matter how deep into the table it is.
+    """
+    time_col = sql.Identifier(time_column)
+    clauses, params = [], []
+    if device_fingerprint is not None:
+        clauses.append(sql.SQL("device_fingerprint = %s"))
+        params.append(device_fingerprint)
+    if since is not None:
+        clauses.append(sql.SQL("{} >= %s").format(time_col))
+        params.append(since)
+    if until is not None:
+        clauses.append(sql.SQL("{} < %s").format(time_col))
+        params.append(until)
+    if cursor is not None:
+        clauses.append(sql.SQL("({}, id) < (%s, %s)").format(time_col))
+        params += list(decode_cursor(cursor))
+    query = sql.SQL("SELECT * FROM {}").format(sql.Identifier(table))
+    if clauses:
+        query += sql.SQL(" WHERE ") + sql.SQL(" AND ").join(clauses)
+    query += sql.SQL(" ORDER BY {} DESC, id DESC").format(time_col)
+    if limit is not None:
+        query += sql.SQL(" LIMIT %s")
+        params.append(limit)
+    return query, params
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def ndjson_chunks(cur):
+    """Serialize the rows of an executed cursor as newline-delimited JSON, a batch at a time."""
+    while True:
+        rows = cur.fetchmany(STREAM_ITERSIZE)
+        if not rows:
+            break
+        yield "".join(json.dumps(row, default=_json_default) + "\n" for row in rows)
@@ -0,0 +1,168 @@
+import re
+import threading
+import logging
+from datetime import datetime, timedelta
+
+from psycopg2 import sql
+
+logger = logging.getLogger(__name__)
+
+PARTITION_INTERVALS = {"daily": ("d", timedelta(days=1)), "weekly": ("w", timedelta(weeks=1))}
+PARTITIONED_TABLES = ("mouse_events", "keystroke_events")
+
+
+def is_partitioned(conn, table):
+    """Whether ``table`` exists as a partitioned parent."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", (table,))
+        return cur.fetchone() is not None
+
+
+class PartitionManager:
+    """Creates and retires the time-range partitions of the high-volume event tables.
+
+    ``tables`` are parents partitioned by range on their event time. One
+    partition covers a day or an ISO week (starting Monday) and is named
+    ``<table>_d20240131`` / ``<table>_w20240129`` after its first day, so
+    both its range and its age can be read back from the catalog. Retention
+    drops whole partitions, which is a catalog change rather than a scan.
+
+    A parent that is still a plain table (a database created before
+    partitioning, not yet run through migrate_partitions.py) is detected on
+    first use and left alone: inserts go straight into it and it gets no
+    partitions or retention until it is migrated and the API restarted.
+    """
+
+    def __init__(self, tables, interval="daily", retention_days=0, premake=2):
+        if interval not in PARTITION_INTERVALS:
+            raise ValueError(f"Unknown partition interval '{interval}', expected one of {list(PARTITION_INTERVALS)}")
+        self.tables = tables
+        self.tag, self.step = PARTITION_INTERVALS[interval]
+        self.retention = timedelta(days=retention_days) if retention_days else None
+        self.premake = premake
+        self._known = {table: set() for table in tables}  # period starts known to exist
+        self._partitioned = {}  # table -> whether it is a partitioned parent, once checked
+        self._lock = threading.Lock()
+        self.created = 0
+        self.dropped = 0
+
+    def period_start(self, ts):
+        # partition bounds are naive, like the TIMESTAMP columns; COPY drops any offset the same way
+        day = datetime(ts.year, ts.month, ts.day)
+        if self.tag == "w":
+            day -= timedelta(days=day.weekday())
+        return day
+
+    def partition_name(self, table, start):
+        return f"{table}_{self.tag}{start:%Y%m%d}"
+
+    def managed(self, conn, table):
+        """Whether ``table`` is a partitioned parent this manager looks after; checked once, then cached."""
+        with self._lock:
+            known = self._partitioned.get(table)
+        if known is not None:
+            return known
+        partitioned = is_partitioned(conn, table)
+        if not partitioned:
+            logger.warning(f"{table} is not a partitioned table, so partition management is off for it; "
+                           f"run migrate_partitions.py and restart the API to enable it")
+        with self._lock:
+            self._partitioned[table] = partitioned
+        return partitioned
+
+    def ensure(self, conn, table, times, commit=True):
+        """Make sure a partition exists for every timestamp in ``times``; commits if it creates any."""
+        if not self.managed(conn, table):
+            return
+        starts = {self.period_start(ts) for ts in times}
+        with self._lock:
+            missing = sorted(starts - self._known[table])
+        if not missing:
+            return
+        with conn.cursor() as cur:
+            # serializes creators across workers; released with the transaction
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (table,))
+            for start in missing:
+                cur.execute(
+                    sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)").format(
+                        sql.Identifier(self.partition_name(table, start)), sql.Identifier(table)),
+                    (start, start + self.step),
+                )
+        if commit:
+            conn.commit()
+        with self._lock:
+            self._known[table].update(missing)
+            self.created += len(missing)
+
+    def ensure_range(self, conn, table, start, end, commit=True):
+        """Partitions for every period from the one holding ``start`` to the one holding ``end``."""
+        period, times = self.period_start(start), []
+        while period <= end:
+            times.append(period)
+            period += self.step
+        self.ensure(conn, table, times, commit)
+
+    def partitions(self, conn, table):
+        """``{period start: partition name}`` for the partitions of ``table`` this manager named."""
+        pattern = re.compile(rf"^{re.escape(table)}_{self.tag}(\d{{8}})$")
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = %s::regclass",
+                (table,),
+            )
+            names = [row["relname"] for row in cur.fetchall()]
+        found = {}
+        for name in names:
+            m = pattern.match(name)
+            if m:
+                found[datetime.strptime(m.group(1), "%Y%m%d")] = name
+        return found
+
+    def drop_expired(self, conn, now=None):
+        """Drop every partition whose whole range is older than the retention window."""
+        if self.retention is None:
+            return []
+        cutoff = (now or datetime.now()) - self.retention
+        dropped = []
+        for table in self.tables:
+            if not self.managed(conn, table):
+                continue
+            expired = [(start, name) for start, name in self.partitions(conn, table).items()
+                       if start + self.step <= cutoff]
+            if not expired:
+                continue
+            with conn.cursor() as cur:
+                for start, name in sorted(expired):
+                    cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(name)))
+                    dropped.append(name)
+            conn.commit()
+            with self._lock:
+                self._known[table].difference_update(start for start, _ in expired)
+                self.dropped += len(expired)
+        if dropped:
+            logger.info(f"Dropped expired partitions: {', '.join(dropped)}")
+        return dropped
+
+    def maintain(self, conn, now=None):
+        """Pre-create the current and next ``premake`` periods, then apply retention."""
+        now = now or datetime.now()
+        for table in self.tables:
+            if not self.managed(conn, table):
+                continue
+            existing = self.partitions(conn, table)
+            with self._lock:
+                self._known[table].update(existing)
+            self.ensure_range(conn, table, now, now + self.premake * self.step)
+        return self.drop_expired(conn, now)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "interval": "weekly" if self.tag == "w" else "daily",
+                "retention_days": self.retention.days if self.retention else None,
+                "known": {table: len(starts) for table, starts in self._known.items()},
+                "unpartitioned": sorted(t for t, partitioned in self._partitioned.items() if not partitioned),
+                "created": self.created,
+                "dropped": self.dropped,
+            }
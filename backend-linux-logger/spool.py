@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import logging
+from typing import Any, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of sending one batch
+SENT = "sent"
+RETRY = "retry"        # network error or 5xx: keep the batch and try again later
+REJECTED = "rejected"  # the API will never accept it: set it aside in the dead-letter file
+
+
+def atomic_write(path: str, data: bytes):
+    """Replace ``path`` with ``data`` so a crash leaves either the old or the new contents."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    dir_fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+class CheckpointStore:
+    """Per-file ``(inode, offset)`` read positions, persisted in one JSON file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.positions: Dict[str, Tuple[int, int]] = {}
+        try:
+            with open(path) as f:
+                self.positions = {p: (v["inode"], v["offset"]) for p, v in json.load(f).items()}
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Ignoring unreadable checkpoint file {path}: {e}")
+
+    def get(self, log_path: str) -> Tuple[Any, int]:
+        return self.positions.get(log_path, (None, 0))
+
+    def save(self, positions: Dict[str, Tuple[int, int]]):
+        if positions == self.positions:
+            return
+        data = {p: {"inode": inode, "offset": offset} for p, (inode, offset) in positions.items()}
+        atomic_write(self.path, json.dumps(data).encode())
+        self.positions = dict(positions)
+
+
+class Spool:
+    """Bounded on-disk queue of batches that could not be sent.
+
+    Each batch is one segment file, written atomically and named by a
+    sequence number so they replay in the order they were spooled. When
+    the segments would exceed ``max_bytes`` the oldest are dropped, so an
+    endpoint that stays offline loses its oldest events rather than filling
+    the disk. Batches the API rejects outright are appended to the
+    ``dead_letter`` file (one JSON line each, up to ``dead_letter_max_bytes`` if set)
+    instead of blocking the ones queued behind them.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, dead_letter: str = None, dead_letter_max_bytes: int = 0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.dead_letter = dead_letter
+        self.dead_letter_max_bytes = dead_letter_max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.segments = sorted(n for n in os.listdir(directory) if n.endswith(".json"))
+        self.sizes = {n: os.path.getsize(os.path.join(directory, n)) for n in self.segments}
+        self.size = sum(self.sizes.values())
+        self._seq = int(self.segments[-1].split(".")[0]) + 1 if self.segments else 0
+        self.dropped = 0
+        self.rejected = 0
+        if self.segments:
+            logger.info(f"Spool holds {len(self.segments)} unsent batches ({self.size} bytes)")
+
+    def append(self, log_type: str, events: List[Any]) -> bool:
+        data = json.dumps({"log_type": log_type, "events": events}).encode()
+        if len(data) > self.max_bytes:
+            logger.error(f"Batch of {len(events)} {log_type} events is larger than the whole spool, dropping it")
+            self.dropped += len(events)
+            return True
+        while self.segments and self.size + len(data) > self.max_bytes:
+            self._drop_oldest()
+        name = f"{self._seq:016d}.json"
+        try:
+            atomic_write(os.path.join(self.directory, name), data)
+        except OSError as e:
+            logger.error(f"Could not spool {log_type} batch: {e}")
+            return False
+        self._seq += 1
+        self.segments.append(name)
+        self.sizes[name] = len(data)
+        self.size += len(data)
+        return True
+
+    def _remove(self, name: str):
+        # sizes are tracked in memory, so a segment deleted behind our back is still accounted for
+        self.segments.remove(name)
+        self.size -= self.sizes.pop(name, 0)
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def _read(self, name: str) -> Tuple[str, List[Any]]:
+        with open(os.path.join(self.directory, name)) as f:
+            segment = json.load(f)
+        return segment["log_type"], segment["events"]
+
+    def _drop_oldest(self):
+        name = self.segments[0]
+        try:
+            self.dropped += len(self._read(name)[1])
+        except (OSError, ValueError, KeyError):
+            pass
+        self._remove(name)
+        logger.warning(f"Spool full, dropped oldest batch {name}")
+
+    def reject(self, log_type: str, events: List[Any]):
+        """Set aside a batch the API refused, so it can be inspected without being retried."""
+        self.rejected += len(events)
+        if not self.dead_letter:
+            logger.error(f"Discarding rejected batch of {len(events)} {log_type} events")
+            return
+        line = json.dumps({"log_type": log_type, "rejected_at": time.time(), "events": events}) + "\n"
+        try:
+            size = os.path.getsize(self.dead_letter) if os.path.exists(self.dead_letter) else 0
+            if self.dead_letter_max_bytes and size + len(line) > self.dead_letter_max_bytes:
+                logger.error(f"Dead-letter file {self.dead_letter} is full, discarding rejected batch "
+                             f"of {len(events)} {log_type} events")
+                return
+            with open(self.dead_letter, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            logger.error(f"Could not write rejected {log_type} batch to {self.dead_letter}: {e}")
+            return
+        logger.error(f"Moved rejected batch of {len(events)} {log_type} events to {self.dead_letter}")
+
+    def replay(self, sender: Callable[[str, List[Any]], str]) -> bool:
+        """Send spooled batches oldest first; stops at the first one to retry. True once the spool is empty.
+
+        ``sender`` returns SENT, RETRY or REJECTED; rejected batches go to the
+        dead-letter file and replay carries on with the next one.
+        """
+        while self.segments:
+            name = self.segments[0]
+            try:
+                log_type, events = self._read(name)
+            except FileNotFoundError:
+                logger.warning(f"Spool segment {name} disappeared, skipping it")
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"Discarding unreadable spool segment {name}: {e}")
+            else:
+                result = sender(log_type, events)
+                if result == RETRY:
+                    return False
+                if result == REJECTED:
+                    self.reject(log_type, events)
+                else:
+                    logger.info(f"Replayed spooled batch of {len(events)} {log_type} events")
+            self._remove(name)
+        return True
@@ -0,0 +1,182 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+import logging
+from typing import List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK = 1 << 20  # bytes read from a log per call
+
+# <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class FileTailer:
+    """Reads complete lines appended to one log file, across rotations.
+
+    The file stays open between reads. ``RotatingFileHandler`` rotates by
+    renaming ``x.log`` to ``x.log.1`` and starting a new ``x.log``, so when
+    the path stops pointing at the open inode the old handle is read to its
+    end before the new file is opened; nothing written before the rename is
+    lost. ``inode``/``offset`` give the position to resume from: if that
+    inode has since been rotated to ``x.log.1`` it is finished first.
+    ``offset`` always sits at the end of the last complete line returned.
+    """
+
+    def __init__(self, path: str, inode: Optional[int] = None, offset: int = 0):
+        self.path = path
+        self.inode = inode
+        self.offset = offset
+        self._f = None
+        self._partial = b""
+
+    def _read(self, f, final=False) -> List[str]:
+        lines = []
+        while True:
+            data = f.read(READ_CHUNK)
+            if not data:
+                break
+            *complete, self._partial = (self._partial + data).split(b"\n")
+            lines += complete
+        if final and self._partial:
+            # the writer has moved on, so an unterminated last line is all there will be
+            lines.append(self._partial)
+            self._partial = b""
+        self.offset = f.tell() - len(self._partial)
+        return [line.decode("utf-8", errors="replace") for line in lines]
+
+    def _rotated_handle(self, inode):
+        try:
+            f = open(f"{self.path}.1", "rb")
+        except FileNotFoundError:
+            return None
+        if os.fstat(f.fileno()).st_ino != inode:
+            f.close()
+            return None
+        return f
+
+    def _attach(self) -> List[str]:
+        lines = []
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return lines
+        st = os.fstat(f.fileno())
+        if self.inode is not None and st.st_ino != self.inode:
+            old = self._rotated_handle(self.inode)
+            if old is not None:
+                logger.info(f"Finishing {self.path}.1 from offset {self.offset} before the new {self.path}")
+                old.seek(self.offset)
+                lines += self._read(old, final=True)
+                old.close()
+            self.offset = 0
+        elif st.st_size < self.offset:
+            logger.info(f"{self.path} is shorter than the saved offset, reading from the start")
+            self.offset = 0
+        self.inode = st.st_ino
+        self._partial = b""
+        f.seek(self.offset)
+        self._f = f
+        return lines + self._read(f)
+
+    def poll(self) -> List[str]:
+        """Lines completed since the last call, oldest first."""
+        if self._f is None:
+            return self._attach()
+        lines = self._read(self._f)
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return lines  # renamed away and the new file is not there yet
+        if st.st_ino != self.inode:
+            logger.info(f"Log rotation detected for {self.path}")
+            lines += self._read(self._f, final=True)
+            self.close()
+            self.inode, self.offset = None, 0
+            lines += self._attach()
+        elif st.st_size < self.offset:
+            logger.info(f"{self.path} truncated, reading from the start")
+            self._f.seek(0)
+            self._partial = b""
+            lines += self._read(self._f)
+        return lines
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+class InotifyWatcher:
+    """Blocks until something in ``directory`` is written, created, moved or deleted."""
+
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f"inotify_add_watch failed for {directory}")
+
+    def wait(self, timeout: float) -> Optional[Set[str]]:
+        """Names changed within ``timeout`` seconds (empty if none), or None if events were lost."""
+        ready, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        if not ready:
+            return set()
+        names = set()
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return names
+        pos = 0
+        while pos + _EVENT.size <= len(buf):
+            _, mask, _, length = _EVENT.unpack_from(buf, pos)
+            pos += _EVENT.size
+            if mask & IN_Q_OVERFLOW:
+                return None
+            names.add(buf[pos:pos + length].rstrip(b"\0").decode(errors="replace"))
+            pos += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Fallback that wakes every ``interval`` seconds and reports everything as changed."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+
+    def wait(self, timeout: float) -> Optional[Set[str]]:
+        time.sleep(max(min(timeout, self.interval), 0))
+        return None
+
+    def close(self):
+        pass
+
+
+def create_watcher(directory: str, poll_interval: float):
+    try:
+        return InotifyWatcher(directory)
+    except (OSError, AttributeError) as e:
+        # no inotify (non-Linux, exhausted watches) or the directory is missing
+        logger.warning(f"inotify unavailable for {directory}, polling every {poll_interval}s: {e}")
+        return PollingWatcher(poll_interval)
@@ -7,17 +7,26 @@ import io
 import os
 import requests
 import torch
-from ultralytics import YOLO
-from transformers import CLIPModel, CLIPProcessor
-from scipy.spatial.distance import cosine
+from utils.embedding_index import create_index
+from utils.model_loader import LazyModel, local_model_path
 from fastapi.middleware.cors import CORSMiddleware
 
-# Download & initialize face detector from Hugging Face (Bingsu/adetailer)
-face_detector = YOLO('https://github.com/lindevs/yolov8-face/releases/latest/download/yolov8n-face-lindevs.pt')
+# Face detector and embedding model, loaded from pretrained_models/ on first use or /warmup:
+#   yolov8n-face-lindevs.pt  from https://github.com/lindevs/yolov8-face/releases
+#   clip-vit-base-patch32/   a save_pretrained() copy of openai/clip-vit-base-patch32
+def load_face_detector():
+    from ultralytics import YOLO
+    return YOLO(local_model_path('yolov8n-face-lindevs.pt'))
 
-# Initialize embedding model
-clip_model = CLIPModel.from_pretrained('openai/clip-vit-base-patch32')
-clip_processor = CLIPProcessor.from_pretrained('openai/clip-vit-base-patch32')
+def load_clip():
+    from transformers import CLIPModel, CLIPProcessor
+    path = local_model_path('clip-vit-base-patch32')
+    model = CLIPModel.from_pretrained(path, local_files_only=True).eval()
+    processor = CLIPProcessor.from_pretrained(path, local_files_only=True)
+    return model, processor
+
+face_detector = LazyModel('yolov8-face', load_face_detector)
+clip = LazyModel('clip', load_clip)
 
 # Database setup
 conn = sqlite3.connect('faces.db', check_same_thread=False)
@@ -29,6 +38,9 @@ c.execute(
        )''')
 conn.commit()
 
+face_index = create_index("faces")
+face_index.sync(c.execute('SELECT user_id, embedding FROM faces').fetchall())
+
 app = FastAPI()
 app.add_middleware(
         CORSMiddleware,
@@ -37,9 +49,20 @@ app.add_middleware(
         allow_methods=["*"],  # Allow all HTTP methods
         allow_headers=["*"],  # Allow all headers
     )
+
+@app.on_event('shutdown')
+def save_index():
+    face_index.save()
+
+@app.post('/warmup')
+def warmup():
+    for model in (face_detector, clip):
+        model.get()
+    return {'models': {m.name: m.stats() for m in (face_detector, clip)}}
+
 def detect_and_crop(image: Image.Image) -> Image.Image:
     """Detects the largest face and returns the cropped face region."""
-    results = face_detector(np.array(image))
+    results = face_detector.get()(np.array(image))
     if not results or not results[0].boxes:
         return None
     boxes = results[0].boxes.xyxy.cpu().numpy()
@@ -50,6 +73,7 @@ def detect_and_crop(image: Image.Image) -> Image.Image:
 
 def get_embedding(face_img: Image.Image) -> np.ndarray:
     """Generates a normalized embedding for a face image."""
+    clip_model, clip_processor = clip.get()
     inputs = clip_processor(images=face_img, return_tensors='pt')
     with torch.no_grad():
         emb = clip_model.get_image_features(**inputs)
@@ -75,6 +99,7 @@ async def enroll(
     avg_emb = np.mean(np.stack(embeddings), axis=0).astype(np.float32)
     c.execute('REPLACE INTO faces VALUES (?,?)', (user_id, avg_emb.tobytes()))
     conn.commit()
+    face_index.upsert(user_id, avg_emb)
     return JSONResponse({'status': 'enrolled', 'user_id': user_id})
 
 @app.post('/identify')
@@ -89,12 +114,8 @@ async def identify(
         return JSONResponse({'error': 'No face detected.'}, status_code=400)
     probe = get_embedding(face)
 
-    best_score, best_id = -1.0, None
-    for user_id, emb_blob in c.execute('SELECT user_id, embedding FROM faces'):
-        enrolled = np.frombuffer(emb_blob, dtype=np.float32)
-        score = 1 - cosine(probe, enrolled)
-        if score > best_score:
-            best_score, best_id = score, user_id
+    matches = face_index.search(probe, k=1)
+    best_id, best_score = matches[0] if matches else (None, -1.0)
 
     if best_score >= threshold:
         return JSONResponse({'result': 'known', 'user_id': best_id, 'score': float(best_score)})
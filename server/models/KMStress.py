@@ -1,5 +1,5 @@
 import asyncio
-import json
+import os
 import sqlite3
 import torch
 from fastapi import FastAPI, HTTPException, Query
@@ -7,6 +7,11 @@ from pydantic import BaseModel
 from datetime import datetime, timezone
 from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
+from utils.km_registry import ModelRegistry
+from utils.km_features import KM_EVENTS_SCHEMA, INSERT_KM_EVENT, MIGRATE_RAW_EVENTS, encode_events, load_features
+from utils.km_runtime import export_torchscript, get_runtime
+from utils.paging import keyset_query
+from utils.rollups import SERIES, bucket_start, create_rollups, pick_resolution
 # --- Autoencoder definition ---
 import torch
 
@@ -53,6 +58,112 @@ class SequenceAutoencoder(torch.nn.Module):
         return out
 
 
+# --- Batched inference across devices ---
+def _linear(x, w, b):
+    # x: (N, ..., in), w: (N, out, in), b: (N, out)
+    shape = x.shape
+    y = torch.baddbmm(b.unsqueeze(1), x.reshape(shape[0], -1, shape[-1]), w.transpose(1, 2))
+    return y.reshape(*shape[:-1], w.size(1))
+
+def _lstm_cell(gates, c):
+    i, f, g, o = gates.chunk(4, dim=-1)
+    c = torch.sigmoid(f) * c + torch.sigmoid(i) * torch.tanh(g)
+    return torch.sigmoid(o) * torch.tanh(c), c
+
+class StackedAutoencoders:
+    """Inference-only view of N per-device autoencoders run as one batch.
+
+    Each device keeps its own weights; they are stacked along a leading
+    device dimension and the LSTM/attention maths is done with batched
+    matmuls, so one pass scores every window. Windows are right-padded to the
+    longest one; padded steps never reach the encoder state or the attention
+    keys and are left out of each device's error.
+    """
+
+    def __init__(self, models):
+        self.n_heads = models[0].attn.num_heads
+        self.hidden_size = models[0].hidden_size
+        states = [m.state_dict() for m in models]
+        self.w = {k: torch.stack([s[k].detach() for s in states]) for k in states[0]}
+
+    def _lstm(self, prefix, xw, h, c, steps, lengths=None):
+        # xw: precomputed input projection, (N, T, 4H) or (N, 4H) if constant over time
+        w_hh = self.w[f"{prefix}.weight_hh_l0"].transpose(1, 2)
+        outs = []
+        for t in range(steps):
+            x_t = xw[:, t] if xw.dim() == 3 else xw
+            h_new, c_new = _lstm_cell(torch.baddbmm(x_t.unsqueeze(1), h.unsqueeze(1), w_hh).squeeze(1), c)
+            if lengths is not None:
+                live = (t < lengths).unsqueeze(1)
+                h_new, c_new = torch.where(live, h_new, h), torch.where(live, c_new, c)
+            h, c = h_new, c_new
+            outs.append(h)
+        return torch.stack(outs, dim=1), h
+
+    def _input_proj(self, prefix, x):
+        bias = self.w[f"{prefix}.bias_ih_l0"] + self.w[f"{prefix}.bias_hh_l0"]
+        return _linear(x, self.w[f"{prefix}.weight_ih_l0"], bias)
+
+    @torch.no_grad()
+    def reconstruct(self, x, lengths):
+        """Reconstructions of padded windows ``x`` (N, T, F) with valid lengths (N,)."""
+        w, H = self.w, self.hidden_size
+        N, T, _ = x.shape
+        zeros = x.new_zeros(N, H)
+
+        enc_out, h = self._lstm("encoder", self._input_proj("encoder", x), zeros, zeros, T, lengths)
+        z = _linear(h, w["fc_enc.weight"], w["fc_enc.bias"])
+        h_dec = _linear(z, w["fc_dec.weight"], w["fc_dec.bias"])
+
+        # multi-head attention, decoder init state as the single query
+        wq, wk, wv = w["attn.in_proj_weight"].chunk(3, dim=1)
+        bq, bk, bv = w["attn.in_proj_bias"].chunk(3, dim=1)
+        hd = H // self.n_heads
+        q = _linear(h_dec, wq, bq).view(N, self.n_heads, 1, hd)
+        k = _linear(enc_out, wk, bk).view(N, T, self.n_heads, hd).transpose(1, 2)
+        v = _linear(enc_out, wv, bv).view(N, T, self.n_heads, hd).transpose(1, 2)
+        scores = q @ k.transpose(-1, -2) / hd ** 0.5                     # (N, heads, 1, T)
+        pad = torch.arange(T) >= lengths.unsqueeze(1)                    # (N, T)
+        scores = scores.masked_fill(pad[:, None, None, :], float("-inf"))
+        ctx = (scores.softmax(dim=-1) @ v).reshape(N, H)
+        attn_out = _linear(ctx, w["attn.out_proj.weight"], w["attn.out_proj.bias"])
+
+        # the decoder input is the same context at every step
+        dec_out, _ = self._lstm("decoder", self._input_proj("decoder", attn_out), h_dec, zeros, T)
+        return _linear(dec_out, w["fc_out.weight"], w["fc_out.bias"])
+
+    def errors(self, seqs):
+        """Mean squared reconstruction error of each device's (T_i, F) window."""
+        lengths = torch.tensor([len(s) for s in seqs])
+        x = torch.nn.utils.rnn.pad_sequence(list(seqs), batch_first=True)
+        out = self.reconstruct(x, lengths)
+        valid = (torch.arange(x.size(1)) < lengths.unsqueeze(1)).unsqueeze(-1)
+        sq = ((out - x) ** 2) * valid
+        return sq.sum(dim=(1, 2)) / (lengths * x.size(2))
+
+def score_windows(models, seqs):
+    """Reconstruction error of each model on its own (T_i, F) window, as a list of floats.
+
+    With a single intra-op thread the per-device LSTM kernels beat the stacked
+    recurrence (same FLOPs, more dispatch); stacking pays off once ``bmm`` can
+    spread devices across cores. Otherwise full windows go through the
+    configured ``VISTA_KM_RUNTIME`` and the rest through eager PyTorch.
+    """
+    runtime = get_runtime(KM_RUNTIME, KM_MODEL_DIR, lambda: build_device_model()[0])
+    if runtime is None and len(models) > 1 and torch.get_num_threads() > 1:
+        return StackedAutoencoders(models).errors(seqs).tolist()
+    errors = []
+    with torch.inference_mode():
+        for model, seq in zip(models, seqs):
+            x = seq.unsqueeze(0)
+            if runtime is not None and runtime.accepts(x):
+                out = torch.from_numpy(runtime.run(model, x))
+            else:
+                out = model(x)
+            errors.append(torch.mean((out - x) ** 2).item())
+    return errors
+
+
 # --- Pydantic models ---
 class Event(BaseModel):
     device_id: str
@@ -66,11 +177,35 @@ class Batch(BaseModel):
 
 # --- Setup ---
 DB_PATH = "events.db"
+KM_MODEL_DIR = os.getenv("VISTA_KM_MODEL_DIR", "km_models")
+KM_MAX_RESIDENT = int(os.getenv("VISTA_KM_MAX_RESIDENT", "256"))
+KM_MEMORY_MB = float(os.getenv("VISTA_KM_MEMORY_MB", "0"))  # 0 = no byte budget
+KM_RUNTIME = os.getenv("VISTA_KM_RUNTIME", "eager")  # eager | onnx (scoring only)
 app     = FastAPI()
-model   = SequenceAutoencoder(input_size=6, hidden_size=64, latent_size=16)
-optimizer = torch.optim.Adam(model.parameters(), lr=1e-3, weight_decay=0.03)
 CRIT      = torch.nn.MSELoss()
 
+def build_device_model():
+    """Fresh autoencoder and optimizer for a device with no snapshot yet."""
+    model = SequenceAutoencoder(input_size=6, hidden_size=64, latent_size=16)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3, weight_decay=0.03)
+    return model, optimizer
+
+def create_registry(snapshot_dir=KM_MODEL_DIR):
+    return ModelRegistry(
+        build_device_model,
+        snapshot_dir=snapshot_dir,
+        max_resident=KM_MAX_RESIDENT,
+        max_bytes=int(KM_MEMORY_MB * 2**20) or None,
+    )
+
+# one autoencoder per device, so scores reflect that device's own behaviour
+registry = create_registry()
+
+def export_device_model(device_id, path, quantized=False, registry=registry):
+    """Export a device's current autoencoder as a frozen TorchScript file for scoring-only use."""
+    with registry.use(device_id) as dm:
+        return export_torchscript(dm.model, path, quantized=quantized)
+
 def init_db():
     conn = sqlite3.connect(DB_PATH)
     conn.execute("""
@@ -81,6 +216,8 @@ def init_db():
             event_type TEXT,
             data TEXT
         )""")
+    conn.execute(KM_EVENTS_SCHEMA)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_km_events_device_ts ON km_events(device_id, timestamp)")
     conn.execute("""
         CREATE TABLE IF NOT EXISTS anomalies(
             id INTEGER PRIMARY KEY,
@@ -88,78 +225,61 @@ def init_db():
             timestamp REAL,
             score REAL
         )""")
+    if conn.execute("SELECT 1 FROM km_events LIMIT 1").fetchone() is None:
+        conn.execute(MIGRATE_RAW_EVENTS)
     conn.commit()
+    # per-device minute/hour anomaly aggregates for /dashboard/km
+    create_rollups(conn, "anomalies")
     conn.close()
 
 @app.on_event("startup")
 def startup():
     init_db()
 
+@app.on_event("shutdown")
+def shutdown():
+    registry.flush()
+
 # --- Helpers ---
 def store_batch(batch: Batch):
     conn = sqlite3.connect(DB_PATH)
-    for ev in batch.events:
-        conn.execute(
-            "INSERT INTO raw_events(device_id,timestamp,event_type,data) VALUES (?,?,?,?)",
-            (ev.device_id, ev.timestamp, ev.event_type, json.dumps(ev.data)),
-        )
+    rows = [row for ev in batch.events for row in encode_events(ev.device_id, [ev.dict()])]
+    conn.executemany(INSERT_KM_EVENT, rows)
     conn.commit()
     conn.close()
 
 
 def load_sequences(device_id, window_size=200):
     conn = sqlite3.connect(DB_PATH)
-    cur = conn.execute(
-        "SELECT timestamp, event_type, data FROM raw_events "
-        "WHERE device_id=? ORDER BY timestamp DESC LIMIT ?",
-        (device_id, window_size),
-    )
-    rows = cur.fetchall()[::-1]
-    conn.close()
-
-    feats = []
-    prev_t = None
-    for t, et, d_json in rows:
-
-        d     = json.loads(d_json)
-        delta = t - prev_t if prev_t else 0.0
-        prev_t = t
-
-        # default zero vector
-        is_click, is_key = 0, 0
-        coords = [0.0, 0.0]
-        key    = [0.0]
-
-        # collapse downs/ups → click/key
-        if et in ("click_down", "click_up"):
-            is_click = 1
-            coords = [d.get("x", 0)/1920, d.get("y", 0)/1080]
-        elif et in ("key_down", "key_up"):
-            is_key = 1
-            key    = [d.get("key_code", 0)/255]
-
-        feats.append([is_click, is_key, delta] + coords + key)
-
-    if not feats:
+    try:
+        # coordinates only for clicks, key codes only for key events
+        feats = load_features(conn, device_id, window_size, by_type=True)
+    finally:
+        conn.close()
+    if feats is None:
         return None
-    return torch.tensor([feats], dtype=torch.float)
+    return torch.from_numpy(feats).unsqueeze(0)
 
 async def train_on_device(device_id):
     seq = load_sequences(device_id)
     if seq is None:
         return None
-    out  = model(seq)
-    loss = CRIT(out, seq)
-    optimizer.zero_grad()
-    loss.backward()
-    optimizer.step()
+    with registry.use(device_id) as dm:
+        out  = dm.model(seq)
+        loss = CRIT(out, seq)
+        dm.optimizer.zero_grad()
+        loss.backward()
+        dm.optimizer.step()
+        dm.steps += 1
+        dm.dirty = True
     return loss.item()
 
 async def infer_device(device_id, threshold=0.01):
     seq = load_sequences(device_id)
     if seq is None:
         return False, 0.0
-    out = model(seq)
+    with registry.use(device_id) as dm, torch.no_grad():
+        out = dm.model(seq)
     err = torch.mean((out - seq) ** 2).item()
     return err > threshold, err
 
@@ -188,12 +308,12 @@ async def push_batch(batch: Batch):
         "INSERT INTO anomalies(device_id,timestamp,score) VALUES (?,?,?)",
         (batch.device_id, timestamp, score * 100),  # percent
     )
-    # keep only latest 1000 raw_events per device
+    # keep only latest 1000 events per device
     conn.execute(
         """
-        DELETE FROM raw_events
+        DELETE FROM km_events
         WHERE id IN (
-          SELECT id FROM raw_events
+          SELECT id FROM km_events
           WHERE device_id=?
           ORDER BY timestamp DESC
           LIMIT -1 OFFSET 1000
@@ -228,16 +348,27 @@ def get_anomalies(
     return [{"timestamp": t, "score": s} for t, s in rows]
 
 @app.get("/dashboard/km")
-def get_all_anomaly_data():
+def get_all_anomaly_data(
+    device_id: Optional[str] = Query(None),
+    start: Optional[float] = Query(None),
+    end: Optional[float] = Query(None),
+    resolution: Optional[str] = Query(None, pattern="^(raw|minute|hour)$"),
+):
+    # raw rows unless a long range (or resolution=) asks for minute/hour buckets (count, mean and max score)
+    resolution = resolution or pick_resolution(start, end)
+    table, columns, order_by = SERIES["anomalies"][resolution]
+    q, params = keyset_query(columns, table, [
+        ("device_id=?", device_id),
+        ("timestamp>=?", bucket_start(start, resolution)),
+        ("timestamp<=?", end),
+    ], order_by=order_by)
+
     conn = sqlite3.connect(DB_PATH)
-    cur = conn.execute("SELECT device_id, timestamp, score FROM anomalies ORDER BY timestamp ASC")
+    cur = conn.execute(q, params)
     rows = cur.fetchall()
     conn.close()
 
-    return [
-        {"device_id": device_id, "timestamp": timestamp, "score": score}
-        for device_id, timestamp, score in rows
-    ]
+    return [dict(zip(columns, row)) for row in rows]
 
 if __name__ == "__main__":
     import uvicorn
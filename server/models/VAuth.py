@@ -1,25 +1,27 @@
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, UploadFile, File, Form, Depends
 from fastapi.responses import JSONResponse
 import sqlite3
 import numpy as np
-import torch, torchaudio, webrtcvad
-from torchaudio.transforms import Resample
-from speechbrain.inference.classifiers import EncoderClassifier
-import io
-from scipy.spatial.distance import cosine
+import torch
+from utils.embedding_index import create_index
+from utils.audio import load_speech
+from utils.voice_encoder import encode, load_optimized
+from utils.model_loader import LazyModel, local_model_path
 from datetime import datetime, timezone
 from fastapi.middleware.cors import CORSMiddleware
 
 
 # Initialize components
-vad = webrtcvad.Vad(1)  # aggressiveness 0–3
-classifier = EncoderClassifier.from_hparams(
-    source="speechbrain/spkrec-ecapa-voxceleb",
-    savedir="pretrained_models/spkrec-ecapa"
-)
+def load_classifier():
+    from speechbrain.inference.classifiers import EncoderClassifier
+    path = local_model_path("spkrec-ecapa")
+    return load_optimized(EncoderClassifier.from_hparams(source=path, savedir=path))
+
+classifier = LazyModel("ecapa", load_classifier)
 
 # Database connection
-conn = sqlite3.connect("speakers.db", check_same_thread=False)
+DB_PATH = "speakers.db"
+conn = sqlite3.connect(DB_PATH, check_same_thread=False)
 c = conn.cursor()
 # Create tables
 c.execute(
@@ -38,28 +40,20 @@ c.execute(
 )
 conn.commit()
 
-def ensure_16k(wav: torch.Tensor, orig_fs: int) -> torch.Tensor:
-    """Resample to 16 kHz if needed."""
-    if orig_fs != 16000:
-        resampler = Resample(orig_freq=orig_fs, new_freq=16000)
-        wav = resampler(wav)
-    return wav
-
-def extract_speech(wav: np.ndarray, fs: int = 16000, frame_ms: int = 30) -> np.ndarray:
-    frames = int(fs * frame_ms / 1000)
-    speech = []
-    for i in range(0, len(wav), frames):
-        frame = wav[i:i+frames]
-        if len(frame) < frames:
-            break
-        pcm = (frame * 32768).astype(np.int16).tobytes()
-        if vad.is_speech(pcm, fs):
-            speech.extend(frame)
-    return np.array(speech)
+speaker_index = create_index("speakers")
+speaker_index.sync(c.execute("SELECT user_id, embedding FROM speakers").fetchall())
+
+def get_db():
+    # one connection per request: handlers run concurrently in the threadpool
+    db = sqlite3.connect(DB_PATH, check_same_thread=False)
+    try:
+        yield db
+    finally:
+        db.close()
 
 def get_embedding(wav_np: np.ndarray) -> np.ndarray:
     signal = torch.from_numpy(wav_np).unsqueeze(0)
-    emb = classifier.encode_batch(signal)
+    emb = encode(classifier.get(), signal)
     return emb.squeeze().cpu().numpy()
 
 def create_app():
@@ -71,43 +65,42 @@ def create_app():
             allow_methods=["*"],  # Allow all HTTP methods
             allow_headers=["*"],  # Allow all headers
         )
+
+    @app.on_event("shutdown")
+    def save_index():
+        speaker_index.save()
+
+    @app.post("/warmup")
+    def warmup():
+        classifier.get()
+        return {"models": {classifier.name: classifier.stats()}}
+
+    # Plain defs: FastAPI runs them in its threadpool, so decoding and encoding never block the loop
     @app.post("/enroll")
-    async def enroll(
+    def enroll(
         user_id: str = Form(...),
         file1: UploadFile = File(...),
         file2: UploadFile = File(...),
-        file3: UploadFile = File(...)
+        file3: UploadFile = File(...),
+        db: sqlite3.Connection = Depends(get_db),
     ):
         embs = []
         for f in (file1, file2, file3):
-            data = await f.read()
-            wav, fs = torchaudio.load(io.BytesIO(data))         # wav: [channels, time]
-            mono = wav.mean(dim=0, keepdim=True)                # convert to mono
-            wav16k = ensure_16k(mono, fs)                       # resample if needed
-            wav_np = wav16k.squeeze(0).numpy()
-            speech = extract_speech(wav_np, 16000)
+            speech = load_speech(f.file)                        # streamed decode, 16 kHz mono, voiced frames
             embs.append(get_embedding(speech))
         avg_emb = np.mean(np.stack(embs), axis=0).astype(np.float32)
-        c.execute("REPLACE INTO speakers VALUES (?,?)", (user_id, avg_emb.tobytes()))
-        conn.commit()
+        db.execute("REPLACE INTO speakers VALUES (?,?)", (user_id, avg_emb.tobytes()))
+        db.commit()
+        speaker_index.upsert(user_id, avg_emb)
         return JSONResponse({"status": "enrolled", "user_id": user_id})
 
     @app.post("/identify")
-    async def identify(file: UploadFile = File(...), threshold: float = Form(0.40)):
-        data = await file.read()
-        wav, fs = torchaudio.load(io.BytesIO(data))
-        mono = wav.mean(dim=0, keepdim=True)
-        wav16k = ensure_16k(mono, fs)
-        wav_np = wav16k.squeeze(0).numpy()
-        speech = extract_speech(wav_np, 16000)
-        probe = get_embedding(speech)
-
-        best_score, best_id = -1.0, None
-        for user_id, emb_blob in c.execute("SELECT user_id, embedding FROM speakers"):
-            enrolled = np.frombuffer(emb_blob, dtype=np.float32)
-            score = 1 - cosine(probe, enrolled)
-            if score > best_score:
-                best_score, best_id = score, user_id
+    def identify(file: UploadFile = File(...), threshold: float = Form(0.40),
+                 db: sqlite3.Connection = Depends(get_db)):
+        probe = get_embedding(load_speech(file.file))
+
+        matches = speaker_index.search(probe, k=1)
+        best_id, best_score = matches[0] if matches else (None, -1.0)
 
         result = None
         if best_score >= threshold:
@@ -120,17 +113,17 @@ def create_app():
         # Log identification
         timestamp = datetime.now(timezone.utc).isoformat()
         user_rec = best_id if result == 'known' else None
-        c.execute(
+        db.execute(
             "INSERT INTO identifications (timestamp, result, user_id) VALUES (?, ?, ?)",
             (timestamp, result, user_rec)
         )
-        conn.commit()
+        db.commit()
 
         return JSONResponse(response)
 
     @app.get("/dashboard/voice")
-    async def dashboard_voice():
-        rows = c.execute(
+    def dashboard_voice(db: sqlite3.Connection = Depends(get_db)):
+        rows = db.execute(
             "SELECT timestamp, result, COALESCE(user_id, 'unknown') AS user_id FROM identifications ORDER BY id"
         ).fetchall()
         data = [ {"timestamp": ts, "result": res, "user_id": uid} for ts, res, uid in rows ]
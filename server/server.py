@@ -1,24 +1,41 @@
+import os
 import sqlite3
-import json
-import io
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query
-from fastapi.responses import JSONResponse
+import asyncio
+import time
+from contextlib import ExitStack
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import numpy as np
-import torch, torchaudio, webrtcvad
-from torchaudio.transforms import Resample
-from speechbrain.inference.classifiers import EncoderClassifier
+import torch
 from datetime import datetime, timezone
-from scipy.spatial.distance import cosine
+from utils.embedding_index import create_index
+from utils.batching import MicroBatcher
+from utils.workers import WorkerPool, PoolSaturated
+from utils.audio import load_speech_timed, resampler_stats
+from utils.voice_encoder import encode, load_optimized
+from utils.km_scheduler import TrainingScheduler
+from utils.km_features import KM_EVENTS_SCHEMA, INSERT_KM_EVENT, MIGRATE_RAW_EVENTS, encode_events
+from utils.km_window import WindowCache
+from utils.model_loader import LazyModel, StartupTimer, local_model_path
+from utils.metrics import Histogram, RequestTiming, render_pool_stats
+from utils.paging import fetch_page, iter_ndjson, keyset_query, scope_cursor, split_cursor
+from utils.rollups import RESOLUTIONS, SERIES, bucket_start, create_rollups, pick_resolution
+
+startup_timer = StartupTimer("server")
 
 # --- Database Setup ---
 DB_PATH = 'ultimate.db'
 conn = sqlite3.connect(DB_PATH, check_same_thread=False)
 c = conn.cursor()
+# WAL lets the background KM trainer write while request handlers read/insert
+c.execute("PRAGMA journal_mode=WAL")
 
 # Replace the global connection with this:
 from fastapi import Depends
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
+    # handlers hand the connection to worker-pool threads, one stage at a time
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     try:
         yield conn
@@ -76,7 +93,8 @@ CREATE TABLE IF NOT EXISTS face_embeddings(
     embedding BLOB
 )""")
 
-# Keystroke/mouse raw events & anomalies
+# Keystroke/mouse events, stored as typed columns (raw_events is the legacy JSON table)
+c.execute(KM_EVENTS_SCHEMA)
 c.execute("""
 CREATE TABLE IF NOT EXISTS raw_events(
     id INTEGER PRIMARY KEY,
@@ -94,96 +112,282 @@ CREATE TABLE IF NOT EXISTS anomalies(
 )""")
 # Add to database setup after table creation
 c.execute("CREATE INDEX IF NOT EXISTS idx_raw_events_device ON raw_events(device_id)")
+c.execute("CREATE INDEX IF NOT EXISTS idx_km_events_device_ts ON km_events(device_id, timestamp)")
 c.execute("CREATE INDEX IF NOT EXISTS idx_anomalies_device ON anomalies(device_id)")
 c.execute("CREATE INDEX IF NOT EXISTS idx_voice_history_pc ON voice_history(pc_id)")
+# (timestamp, id) keyset pagination for the dashboards, with and without a device filter
+c.execute("CREATE INDEX IF NOT EXISTS idx_anomalies_ts ON anomalies(timestamp, id)")
+c.execute("CREATE INDEX IF NOT EXISTS idx_anomalies_device_ts ON anomalies(device_id, timestamp, id)")
+c.execute("CREATE INDEX IF NOT EXISTS idx_voice_history_ts ON voice_history(timestamp, id)")
+c.execute("CREATE INDEX IF NOT EXISTS idx_voice_history_pc_ts ON voice_history(pc_id, timestamp, id)")
+
+# Carry legacy JSON events over the first time the typed table is created
+if c.execute("SELECT 1 FROM km_events LIMIT 1").fetchone() is None:
+    c.execute(MIGRATE_RAW_EVENTS)
 
 conn.commit()
+# Minute/hour aggregates for the dashboards, kept current by insert triggers
+create_rollups(conn, "anomalies", "voice_history")
+startup_timer.mark("database")
+
+# Speaker search index (backend chosen by VISTA_SEARCH_BACKEND), reconciled with the DB
+voice_index = create_index("voice")
+voice_index.sync(c.execute("SELECT user_id, embedding FROM voice_embeddings").fetchall())
+startup_timer.mark("voice_index")
+
+# --- Worker Pools ---
+# Decode/resample/VAD may run in threads or forked processes; model work stays
+# in threads because it shares in-process weights.
+audio_pool = WorkerPool(
+    "audio",
+    kind=os.getenv("VISTA_AUDIO_POOL_KIND", "thread"),
+    max_workers=int(os.getenv("VISTA_AUDIO_WORKERS", "0")) or None,
+    max_queue=int(os.getenv("VISTA_AUDIO_QUEUE", "32")),
+)
+model_pool = WorkerPool(
+    "model",
+    kind="thread",
+    max_workers=int(os.getenv("VISTA_MODEL_WORKERS", "2")),
+    max_queue=int(os.getenv("VISTA_MODEL_QUEUE", "64")),
+)
+
+startup_timer.mark("worker_pools")
 
 # --- Initialize Models ---
-# Voice VAD and encoder
-vad = webrtcvad.Vad(1)
-voice_clf = EncoderClassifier.from_hparams(
-    source="speechbrain/spkrec-ecapa-voxceleb",
-    savedir="pretrained_models/spkrec-ecapa"
-)
-# Keystroke Autoencoder (import your existing SequenceAutoencoder and optimizer here)
-from models.KMStress import SequenceAutoencoder, optimizer, CRIT, load_sequences, infer_device, train_on_device
-model = SequenceAutoencoder(input_size=6, hidden_size=64, latent_size=16)
+# Voice encoder, loaded from pretrained_models/ on first use or /warmup
+def load_voice_encoder():
+    from speechbrain.inference.classifiers import EncoderClassifier
+    path = local_model_path("spkrec-ecapa")
+    clf = EncoderClassifier.from_hparams(source=path, savedir=path)
+    # int8/TorchScript/thread settings from VISTA_ECAPA_* and VISTA_TORCH_*; all off by default
+    return load_optimized(clf)
+
+voice_clf = LazyModel("ecapa", load_voice_encoder)
+# Keystroke autoencoders, one per device, paged in and out of memory on demand
+from models.KMStress import CRIT, create_registry, score_windows
+km_models = create_registry()
+startup_timer.mark("models")
 
 app = FastAPI(title="Ultimate VAuth Server")
 
+# --- Metrics ---
+stage_seconds = Histogram("vista_stage_seconds", "Time spent in each request pipeline stage")
+# Stage breakdown on responses, for browser devtools / curl -v; off by default
+SERVER_TIMING = os.getenv("VISTA_SERVER_TIMING", "0") == "1"
+
+@app.middleware("http")
+async def mark_received(request: Request, call_next):
+    # the multipart body is read after this, so handler entry minus this is the upload time
+    request.state.received = time.perf_counter()
+    return await call_next(request)
+
+def timing_headers(timing: RequestTiming) -> dict:
+    return {"Server-Timing": timing.server_timing()} if SERVER_TIMING else {}
+
+@app.exception_handler(PoolSaturated)
+async def pool_saturated(request, exc):
+    return JSONResponse({"detail": str(exc)}, status_code=429, headers={"Retry-After": "1"})
+
+@app.on_event("shutdown")
+def shutdown():
+    voice_index.save()
+    km_models.flush()
+    audio_pool.shutdown()
+    model_pool.shutdown()
+
 # --- Helper Functions ---
-def ensure_16k(wav: torch.Tensor, orig_fs: int) -> torch.Tensor:
-    if orig_fs != 16000:
-        wav = Resample(orig_freq=orig_fs, new_freq=16000)(wav)
-    return wav
-
-def extract_speech(wav: np.ndarray, fs: int = 16000, frame_ms: int = 30) -> np.ndarray:
-    frames = int(fs * frame_ms / 1000)
-    speech = []
-    for i in range(0, len(wav), frames):
-        frame = wav[i:i+frames]
-        if len(frame) < frames:
-            break
-        pcm = (frame * 32768).astype(np.int16).tobytes()
-        if vad.is_speech(pcm, fs):
-            speech.extend(frame)
-    return np.array(speech)
-
-def get_voice_embedding(wav_np: np.ndarray) -> np.ndarray:
-    sig = torch.from_numpy(wav_np).unsqueeze(0)
-    emb = voice_clf.encode_batch(sig)
-    return emb.squeeze().cpu().numpy()
+def encode_voice_batch(wavs: list) -> list:
+    """Zero-pad a list of 16 kHz signals and embed them in one forward pass."""
+    lens = [len(w) for w in wavs]
+    max_len = max(lens)
+    sig = torch.zeros(len(wavs), max_len)
+    for i, w in enumerate(wavs):
+        sig[i, :len(w)] = torch.from_numpy(w)
+    rel_lens = torch.tensor([n / max_len for n in lens])
+    emb = encode(voice_clf.get(), sig, wav_lens=rel_lens)
+    return list(emb.squeeze(1).cpu().numpy())
+
+# Concurrent probes are collected for a few ms and encoded together
+voice_batcher = MicroBatcher(
+    encode_voice_batch,
+    max_batch=int(os.getenv("VISTA_ENCODER_MAX_BATCH", "16")),
+    max_wait_ms=float(os.getenv("VISTA_ENCODER_MAX_WAIT_MS", "5")),
+    pool=model_pool,
+    stage="encode",
+)
+
+async def get_voice_embedding(wav_np: np.ndarray) -> np.ndarray:
+    if wav_np.size == 0:
+        raise HTTPException(status_code=422, detail="No speech detected in audio")
+    return await voice_batcher.submit(wav_np.astype(np.float32, copy=False))
+
+async def preprocess_upload(upload: UploadFile, timing: RequestTiming = None, received: float = None) -> np.ndarray:
+    # thread workers stream straight from the spooled upload; process workers need picklable bytes
+    if audio_pool.kind == "thread":
+        src = upload.file
+    else:
+        src = await upload.read()
+    if timing is not None and received is not None:
+        # one observation from receipt until the audio is ready to hand to a worker
+        timing.add("upload", time.perf_counter() - received)
+    speech, timings = await audio_pool.run("preprocess", load_speech_timed, src)
+    if timing is not None:
+        timing.update(timings)
+    return speech
 
 # --- KM Helpers ---
-def load_sequences(conn, device_id, window_size=200):
-    cur = conn.execute(
-        "SELECT timestamp, event_type, data FROM raw_events "
-        "WHERE device_id=? ORDER BY timestamp DESC LIMIT ?",
-        (device_id, window_size),
-    )
-    rows = cur.fetchall()[::-1]  # Reverse to get chronological order
-
-    feats = []
-    prev_t = None
-    for row in rows:
-        t, et, d_json = row['timestamp'], row['event_type'], row['data']
-        d = json.loads(d_json)
-        delta = t - prev_t if prev_t else 0.0
-        prev_t = t
-
-        # Feature normalization
-        is_click = 1 if et in ("click_down", "click_up") else 0
-        is_key = 1 if et in ("key_down", "key_up") else 0
-        x = d.get('x', 0)/1920  # Normalize assuming 1080p screen
-        y = d.get('y', 0)/1080
-        key = d.get('key_code', 0)/255  # Normalize keycodes
-        
-        feats.append([is_click, is_key, delta, x, y, key])
-
-    if not feats:
-        return None
-    return torch.tensor([feats], dtype=torch.float32)
-
-async def train_on_device(device_id, conn):
-    seq = load_sequences(conn, device_id)
-    if seq is None:
-        return None
-    out = model(seq)
-    loss = CRIT(out, seq)
-    optimizer.zero_grad()
-    loss.backward()
-    optimizer.step()
-    return loss.item()
-
-async def infer_device(device_id, conn, threshold=0.01):
-    seq = load_sequences(conn, device_id)
-    if seq is None:
-        return False, 0.0
-    with torch.no_grad():
-        out = model(seq)
-    err = torch.mean((out - seq) ** 2).item()
-    return err > threshold, err
+# Normalized feature windows, appended on ingest instead of rebuilt from the DB each step
+km_windows = WindowCache(
+    window_size=200,
+    max_devices=int(os.getenv("VISTA_KM_WINDOW_DEVICES", "4096")),
+)
+
+def train_step(device_id, ts):
+    """One training step on the device's current window."""
+    db = sqlite3.connect(DB_PATH, check_same_thread=False)
+    try:
+        with km_windows.use(db, device_id) as seq:
+            if seq is None:
+                return None
+            with km_models.use(device_id) as dm:
+                out = dm.model(seq)
+                loss = CRIT(out, seq)
+                dm.optimizer.zero_grad()
+                loss.backward()
+                dm.optimizer.step()
+                dm.steps += 1
+                dm.dirty = True
+        return {"loss": loss.item()}
+    finally:
+        db.close()
+
+def score_devices(items, threshold=0.01):
+    """Score the windows of every ``(device_id, ts)`` in one pass and record the anomalies."""
+    db = sqlite3.connect(DB_PATH, check_same_thread=False)
+    try:
+        # windows and models stay checked out until the batch has been scored
+        with ExitStack() as stack:
+            scored, models, seqs = [], [], []
+            for device_id, ts in items:
+                seq = stack.enter_context(km_windows.use(db, device_id))
+                if seq is None:
+                    continue
+                dm = stack.enter_context(km_models.use(device_id))
+                scored.append((device_id, ts))
+                models.append(dm.model)
+                seqs.append(seq[0])
+            errors = score_windows(models, seqs) if models else []
+        db.executemany(
+            "INSERT INTO anomalies(device_id,timestamp,score) VALUES (?,?,?)",
+            [(device_id, ts, err*100) for (device_id, ts), err in zip(scored, errors)])
+        db.commit()
+        results = {
+            device_id: {"anomaly": err > threshold, "score": err*100, "timestamp": ts}
+            for (device_id, ts), err in zip(scored, errors)
+        }
+        return [results.get(device_id) for device_id, _ in items]
+    finally:
+        db.close()
+
+# Ingest only marks devices dirty; training runs here, once per device per tick,
+# and the devices trained in a tick are then scored together
+km_scheduler = TrainingScheduler(
+    train_step,
+    pool=model_pool,
+    interval=float(os.getenv("VISTA_KM_TRAIN_INTERVAL", "1.0")),
+    score=score_devices,
+    score_batch=int(os.getenv("VISTA_KM_SCORE_BATCH", "64")),
+)
+
+# --- KM Retention ---
+KM_KEEP_EVENTS = int(os.getenv("VISTA_KM_KEEP_EVENTS", "1000"))
+KM_TRIM_INTERVAL = float(os.getenv("VISTA_KM_TRIM_INTERVAL", "30"))
+km_trim_pending = set()
+
+def trim_km_events(device_ids, keep=KM_KEEP_EVENTS):
+    """Drop everything older than each device's ``keep``-th newest event."""
+    db = sqlite3.connect(DB_PATH)
+    try:
+        for device_id in device_ids:
+            row = db.execute(
+                "SELECT timestamp FROM km_events WHERE device_id=? "
+                "ORDER BY timestamp DESC LIMIT 1 OFFSET ?",
+                (device_id, keep - 1),
+            ).fetchone()
+            if row is not None:
+                db.execute("DELETE FROM km_events WHERE device_id=? AND timestamp<?", (device_id, row[0]))
+        db.commit()
+    finally:
+        db.close()
+
+def execute_write(query, params):
+    """One write on its own connection, for async handlers to run in the threadpool."""
+    db = sqlite3.connect(DB_PATH)
+    try:
+        db.execute(query, params)
+        db.commit()
+    finally:
+        db.close()
+
+def store_km_events(conn, device_id, events):
+    rows = encode_events(device_id, events)
+    try:
+        conn.executemany(INSERT_KM_EVENT, rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return rows
+
+async def km_trim_loop():
+    while True:
+        await asyncio.sleep(KM_TRIM_INTERVAL)
+        if not km_trim_pending:
+            continue
+        devices = list(km_trim_pending)
+        km_trim_pending.clear()
+        try:
+            await model_pool.run("km_trim", trim_km_events, devices)
+        except Exception:
+            km_trim_pending.update(devices)
+
+background_tasks = []
+
+@app.on_event("startup")
+async def start_background_tasks():
+    km_scheduler.start()
+    background_tasks.append(asyncio.create_task(km_trim_loop()))
+
+# --- Model Warm-up ---
+lazy_models = [voice_clf]
+
+def warm_voice_encoder():
+    # one short silent clip runs every layer once, so the first real probe pays no first-call cost
+    encode_voice_batch([np.zeros(16000, dtype=np.float32)])
+
+def warm_models():
+    for model in lazy_models:
+        model.get()
+    warm_voice_encoder()
+
+@app.on_event("startup")
+async def finish_startup():
+    startup_timer.done()
+    if os.getenv("VISTA_WARMUP_ON_STARTUP", "0") == "1":
+        background_tasks.append(asyncio.create_task(model_pool.run("warmup", warm_models)))
+
+@app.post("/warmup")
+async def warmup():
+    """Load every lazily loaded model now; readiness probes can call this before taking traffic."""
+    await model_pool.run("warmup", warm_models)
+    return {"models": {m.name: m.stats() for m in lazy_models}, "startup": startup_timer.stats()}
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await km_scheduler.stop()
+    for task in background_tasks:
+        task.cancel()
+
 # --- API Endpoints ---
 
 # PC & User Registration
@@ -216,50 +420,37 @@ def usb_event(pc_id: str = Form(...), event_type: str = Form(...), timestamp: fl
 # Voice Endpoints
 @app.post("/voice/enroll")
 async def voice_enroll(user_id: str = Form(...), file1: UploadFile = File(...), file2: UploadFile = File(...), file3: UploadFile = File(...)):
-    embs = []
-    for f in (file1, file2, file3):
-        data = await f.read()
-        wav, fs = torchaudio.load(io.BytesIO(data))
-        mono = wav.mean(dim=0, keepdim=True)
-        wav16k = ensure_16k(mono, fs)
-        wav_np = wav16k.squeeze(0).numpy()
-        speech = extract_speech(wav_np)
-        embs.append(get_voice_embedding(speech))
+    speeches = await asyncio.gather(*(preprocess_upload(f) for f in (file1, file2, file3)))
+    embs = await asyncio.gather(*(get_voice_embedding(sp) for sp in speeches))
     avg = np.mean(np.stack(embs), axis=0).astype(np.float32)
-    c.execute("REPLACE INTO voice_embeddings VALUES (?,?)", (user_id, avg.tobytes()))
-    conn.commit()
+    await run_in_threadpool(execute_write, "REPLACE INTO voice_embeddings VALUES (?,?)", (user_id, avg.tobytes()))
+    voice_index.upsert(user_id, avg)
     return JSONResponse({"status": "voice_enrolled", "user_id": user_id})
 
 @app.post("/voice/identify")
-async def voice_identify(file: UploadFile = File(...), threshold: float = Form(0.40), pc_id: str = Form(...)):
-    data = await file.read()
-    wav, fs = torchaudio.load(io.BytesIO(data))
-    mono = wav.mean(dim=0, keepdim=True)
-    wav16k = ensure_16k(mono, fs)
-    speech = extract_speech(wav16k.squeeze(0).numpy())
-    probe = get_voice_embedding(speech)
-
-    best_score, best_id = -1.0, None
-    for user_id, blob in c.execute("SELECT user_id, embedding FROM voice_embeddings"):
-        enrolled = np.frombuffer(blob, dtype=np.float32)
-        score = 1 - cosine(probe, enrolled)
-        if score > best_score:
-            best_score, best_id = score, user_id
+async def voice_identify(request: Request, file: UploadFile = File(...), threshold: float = Form(0.40), pc_id: str = Form(...), top_k: int = Form(1)):
+    timing = RequestTiming(stage_seconds, "voice_identify")
+    speech = await preprocess_upload(file, timing, request.state.received)
+    with timing.stage("embed"):
+        probe = await get_voice_embedding(speech)
+
+    with timing.stage("search"):
+        matches = voice_index.search(probe, k=max(top_k, 1))
+    best_id, best_score = matches[0] if matches else (None, -1.0)
+    candidates = [{"user_id": uid, "score": score} for uid, score in matches]
     ts = datetime.now(timezone.utc).timestamp()
-    if best_score >= threshold:
-        c.execute(
+    known = best_score >= threshold
+    with timing.stage("history_write"):
+        await run_in_threadpool(
+            execute_write,
             "INSERT INTO voice_history VALUES (?,?,?,?,?,?)",
-            (None, pc_id, best_id, ts, "known", best_score)  # Now using pc_id from form
+            (None, pc_id, best_id if known else None, ts, "known" if known else "unknown", best_score)
         )
-        conn.commit()
-        return JSONResponse({"result": "known", "user_id": best_id, "score": best_score})
+    if known:
+        body = {"result": "known", "user_id": best_id, "score": best_score, "candidates": candidates}
     else:
-        c.execute(
-            "INSERT INTO voice_history VALUES (?,?,?,?,?,?)",
-            (None, pc_id, None, ts, "unknown", best_score)  # Now using pc_id from form
-        )
-        conn.commit()
-        return JSONResponse({"result": "unknown", "max_score": best_score})
+        body = {"result": "unknown", "max_score": best_score, "candidates": candidates}
+    return JSONResponse(body, headers=timing_headers(timing))
 
 
 # Keystroke/Mouse Endpoints
@@ -270,42 +461,55 @@ async def push_km(batch: dict, conn: sqlite3.Connection = Depends(get_db)):
         events = batch['events']
         
         # Validate event format
-        for ev in events:
-            if not all(k in ev for k in ('timestamp', 'event_type', 'data')):
-                raise HTTPException(status_code=400, detail="Invalid event format")
-            
-            # Insert each event inside the loop
-            conn.execute(
-                "INSERT INTO raw_events(device_id,timestamp,event_type,data) VALUES (?,?,?,?)",
-                (device_id, ev['timestamp'], ev['event_type'], json.dumps(ev['data']))
-            )
-        # Cleanup old events
-        conn.execute("""
-            DELETE FROM raw_events WHERE id IN (
-                SELECT id FROM raw_events
-                WHERE device_id=?
-                ORDER BY timestamp DESC
-                LIMIT -1 OFFSET 1000
-            )""", (device_id,))
-        
-        # Process anomalies
-        loss = await train_on_device(device_id, conn)
-        anomaly, score = await infer_device(device_id, conn)
-        
-        ts = events[-1]['timestamp'] if events else datetime.now(timezone.utc).timestamp()
-        conn.execute(
-            "INSERT INTO anomalies(device_id,timestamp,score) VALUES (?,?,?)",
-            (device_id, ts, score*100))
-        
-        conn.commit()
-        return {"anomaly": anomaly, "score": score*100, "loss": loss}
+        if not all(all(k in ev for k in ('timestamp', 'event_type', 'data')) for ev in events):
+            raise HTTPException(status_code=400, detail="Invalid event format")
+
+        # SQLite blocks, so the write runs off the event loop; the scheduler state below stays on it
+        rows = await run_in_threadpool(store_km_events, conn, device_id, events)
+        km_windows.push(device_id, rows)
+        # old rows are trimmed by the background retention loop, not per request
+        km_trim_pending.add(device_id)
 
+        # Training and scoring happen in the background; report the last published score
+        ts = events[-1]['timestamp'] if events else datetime.now(timezone.utc).timestamp()
+        km_scheduler.mark_dirty(device_id, ts)
+        last = km_scheduler.latest.get(device_id, {})
+        return {
+            "status": "queued",
+            "anomaly": last.get("anomaly"),
+            "score": last.get("score"),
+            "loss": last.get("loss"),
+            "scored_at": last.get("timestamp"),
+        }
+
+    except HTTPException:
+        raise
     except Exception as e:
-            conn.rollback()
             raise HTTPException(status_code=500, detail=str(e))
 
 # --- API Endpoints ---
 
+@app.get("/workers/stats")
+def worker_stats():
+    return {
+        "audio": audio_pool.stats(),
+        "model": model_pool.stats(),
+        "encoder_batches": voice_batcher.stats(),
+        # per process: with VISTA_AUDIO_POOL_KIND=process each worker keeps its own cache
+        "resampler_cache": resampler_stats(),
+        "km_models": km_models.stats(),
+        "km_scheduler": km_scheduler.stats(),
+        "km_windows": km_windows.stats(),
+        "models": {m.name: m.stats() for m in lazy_models},
+        "startup": startup_timer.stats(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Stage latency histograms and worker-pool counters in Prometheus text format."""
+    lines = stage_seconds.render() + render_pool_stats([audio_pool, model_pool])
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
 # Dashboard APIs
 @app.get("/dashboard/pcs")
 def list_pcs():
@@ -322,52 +526,94 @@ def list_mappings():
     rows = c.execute("SELECT pc_id, user_id FROM pc_user_map").fetchall()
     return [{"pc_id": pc, "user_id": user} for pc, user in rows]
 
+# Time-series endpoints return one page per call, oldest first; the X-Next-Cursor
+# header (absent on the last page) is passed back as ?cursor= for the next one.
+# format=ndjson streams every matching row instead, without building the list.
+DASHBOARD_PAGE_SIZE = int(os.getenv("VISTA_DASHBOARD_PAGE_SIZE", "1000"))
+DASHBOARD_MAX_PAGE_SIZE = 10000
+
+def paged_rows(columns, table, filters, cursor, limit, fmt, order_by=("timestamp", "id"), headers=None, scope=None):
+    """One page (or an NDJSON stream) of ``table``; with ``scope`` the next cursor is tagged with it."""
+    headers = dict(headers or {})
+    try:
+        if fmt == "ndjson":
+            q, params = keyset_query(columns, table, filters, cursor, limit, order_by)
+            connect = lambda: sqlite3.connect(DB_PATH, check_same_thread=False)
+            return StreamingResponse(
+                iter_ndjson(connect, columns, q, params),
+                media_type="application/x-ndjson",
+                headers=headers,
+            )
+        rows, next_cursor = fetch_page(conn, columns, table, filters, cursor, limit or DASHBOARD_PAGE_SIZE, order_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        headers["X-Next-Cursor"] = scope_cursor(scope, next_cursor) if scope else next_cursor
+    return JSONResponse(rows, headers=headers)
+
+def series_resolution(resolution, start, end, cursor):
+    """``(resolution, cursor)`` for a series page.
+
+    Series cursors carry the resolution they were issued for, so a range with
+    an open ``end`` keeps the resolution of its first page even once enough
+    time has passed for ``pick_resolution`` to choose another one.
+    """
+    if cursor is None:
+        return resolution or pick_resolution(start, end), None
+    try:
+        issued, cursor = split_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if issued != "raw" and issued not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"Malformed page cursor: unknown resolution {issued!r}")
+    if resolution and resolution != issued:
+        raise HTTPException(status_code=400, detail=f"Cursor was issued for resolution={issued}, not {resolution}")
+    return issued, cursor
+
+def series_rows(source, resolution, filters, cursor, limit, fmt):
+    """Raw rows or rollup buckets of ``source``; X-Resolution says which were returned."""
+    table, columns, order_by = SERIES[source][resolution]
+    return paged_rows(columns, table, filters, cursor, limit, fmt, order_by,
+                      {"X-Resolution": resolution}, scope=resolution)
+
+# Without a range or an explicit resolution the raw rows are returned. Given a
+# start, short ranges get raw rows and longer ones minute or hour buckets
+# (count, mean score, max score; known/unknown counts for voice), so the amount
+# returned depends on the requested range rather than on how many raw rows it covers.
 @app.get("/dashboard/km/anomalies")
-def dashboard_km(pc_id: str = Query(None), start: float = Query(None), end: float = Query(None)):
-    q = "SELECT device_id, timestamp, score FROM anomalies"
-    params = []
-    if pc_id:
-        q += " WHERE device_id=?"
-        params.append(pc_id)
-    if start is not None:
-        q += " AND timestamp>=?" if params else " WHERE timestamp>=?"
-        params.append(start)
-    if end is not None:
-        q += " AND timestamp<=?" if params else " WHERE timestamp<=?"
-        params.append(end)
-    rows = c.execute(q, tuple(params)).fetchall()
-    return [{"device_id": d, "timestamp": t, "score": s} for d, t, s in rows]
+def dashboard_km(pc_id: str = Query(None), start: float = Query(None), end: float = Query(None),
+                 resolution: str = Query(None, pattern="^(raw|minute|hour)$"),
+                 cursor: str = Query(None), limit: int = Query(None, ge=1, le=DASHBOARD_MAX_PAGE_SIZE),
+                 fmt: str = Query("json", alias="format", pattern="^(json|ndjson)$")):
+    resolution, cursor = series_resolution(resolution, start, end, cursor)
+    filters = [("device_id=?", pc_id or None), ("timestamp>=?", bucket_start(start, resolution)),
+               ("timestamp<=?", end)]
+    return series_rows("anomalies", resolution, filters, cursor, limit, fmt)
 
 @app.get("/dashboard/voice/history")
-def dashboard_voice(pc_id: str = Query(None), user_id: str = Query(None), start: float = Query(None), end: float = Query(None)):
-    q = "SELECT pc_id, user_id, timestamp, result, score FROM voice_history"
-    params = []
-    clauses = []
-    if pc_id:
-        clauses.append("pc_id=?"); params.append(pc_id)
+def dashboard_voice(pc_id: str = Query(None), user_id: str = Query(None), start: float = Query(None), end: float = Query(None),
+                    resolution: str = Query(None, pattern="^(raw|minute|hour)$"),
+                    cursor: str = Query(None), limit: int = Query(None, ge=1, le=DASHBOARD_MAX_PAGE_SIZE),
+                    fmt: str = Query("json", alias="format", pattern="^(json|ndjson)$")):
+    # buckets count known/unknown results per PC; filtering on a user needs the raw rows
     if user_id:
-        clauses.append("user_id=?"); params.append(user_id)
-    if start is not None:
-        clauses.append("timestamp>=?"); params.append(start)
-    if end   is not None:
-        clauses.append("timestamp<=?"); params.append(end)
-    if clauses:
-        q += " WHERE " + " AND ".join(clauses)
-    rows = c.execute(q, tuple(params)).fetchall()
-    return [
-        {"pc_id": pc, "user_id": uid, "timestamp": ts, "result": res, "score": sc}
-        for pc, uid, ts, res, sc in rows
-    ]
+        if resolution not in (None, "raw"):
+            raise HTTPException(status_code=400, detail="Filtering on user_id needs resolution=raw")
+        resolution = "raw"
+    resolution, cursor = series_resolution(resolution, start, end, cursor)
+    filters = [("pc_id=?", pc_id or None), ("timestamp>=?", bucket_start(start, resolution)),
+               ("timestamp<=?", end)]
+    if resolution == "raw":
+        filters.append(("user_id=?", user_id or None))
+    return series_rows("voice_history", resolution, filters, cursor, limit, fmt)
 
 
 @app.get("/km/anomalies")
-def get_km(device_id: str = Query(...), start: float = Query(None), end: float = Query(None)):
-    q = "SELECT timestamp, score FROM anomalies WHERE device_id=?"
-    params = [device_id]
-    if start: q += " AND timestamp>=?"; params.append(start)
-    if end:   q += " AND timestamp<=?"; params.append(end)
-    rows = conn.execute(q, tuple(params)).fetchall()
-    return [{"timestamp": t, "score": s} for t,s in rows]
+def get_km(device_id: str = Query(...), start: float = Query(None), end: float = Query(None),
+           cursor: str = Query(None), limit: int = Query(None, ge=1, le=DASHBOARD_MAX_PAGE_SIZE),
+           fmt: str = Query("json", alias="format", pattern="^(json|ndjson)$")):
+    filters = [("device_id=?", device_id), ("timestamp>=?", start), ("timestamp<=?", end)]
+    return paged_rows(("timestamp", "score"), "anomalies", filters, cursor, limit, fmt)
 
 if __name__ == "__main__":
     import uvicorn
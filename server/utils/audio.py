@@ -0,0 +1,212 @@
+import io
+import os
+import math
+import time
+from functools import lru_cache
+import numpy as np
+import soundfile as sf
+import torch, torchaudio, webrtcvad
+from torchaudio.transforms import Resample
+
+# Kept free of model state so it can run inside process-pool workers.
+VAD_MODE = 1  # aggressiveness 0–3
+VAD_HANGOVER_FRAMES = int(os.getenv("VISTA_VAD_HANGOVER_FRAMES", "0"))
+RESAMPLER_CACHE_SIZE = int(os.getenv("VISTA_RESAMPLER_CACHE_SIZE", "8"))
+DECODE_BLOCK_FRAMES = int(os.getenv("VISTA_DECODE_BLOCK_FRAMES", "16384"))
+
+@lru_cache(maxsize=RESAMPLER_CACHE_SIZE)
+def get_resampler(orig_fs: int, new_fs: int) -> Resample:
+    """Shared Resample per rate pair; building one recomputes its sinc kernel."""
+    return Resample(orig_freq=orig_fs, new_freq=new_fs)
+
+def resampler_stats() -> dict:
+    info = get_resampler.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
+
+def ensure_16k(wav: torch.Tensor, orig_fs: int) -> torch.Tensor:
+    """Resample to 16 kHz if needed."""
+    if orig_fs != 16000:
+        wav = get_resampler(orig_fs, 16000)(wav)
+    return wav
+
+def smooth_mask(mask: np.ndarray, hangover: int) -> np.ndarray:
+    """Keep ``hangover`` frames after every voiced frame so word endings survive."""
+    if hangover <= 0 or not mask.any():
+        return mask
+    kernel = np.ones(hangover + 1, dtype=np.int32)
+    return np.convolve(mask.astype(np.int32), kernel)[:len(mask)] > 0
+
+def speech_mask(wav: np.ndarray, fs: int = 16000, frame_ms: int = 30, vad=None) -> np.ndarray:
+    """Per-frame WebRTC VAD decisions for every complete frame of ``wav``.
+
+    The VAD keeps internal state between frames, so each clip gets its own
+    instance unless the caller is continuing a stream.
+    """
+    vad = vad or webrtcvad.Vad(VAD_MODE)
+    frame_len = int(fs * frame_ms / 1000)
+    n_frames = len(wav) // frame_len
+    if n_frames == 0:
+        return np.zeros(0, dtype=bool)
+    # one int16 conversion for the whole clip; frames are zero-copy slices of it
+    pcm = np.clip(wav[:n_frames * frame_len] * 32768, -32768, 32767).astype(np.int16)
+    buf = memoryview(pcm.tobytes())
+    step = 2 * frame_len
+    return np.fromiter(
+        (vad.is_speech(buf[i:i + step], fs) for i in range(0, n_frames * step, step)),
+        dtype=bool,
+        count=n_frames,
+    )
+
+def extract_speech(wav: np.ndarray, fs: int = 16000, frame_ms: int = 30, hangover: int = None) -> np.ndarray:
+    frame_len = int(fs * frame_ms / 1000)
+    mask = speech_mask(wav, fs, frame_ms)
+    mask = smooth_mask(mask, VAD_HANGOVER_FRAMES if hangover is None else hangover)
+    frames = wav[:len(mask) * frame_len].reshape(len(mask), frame_len)
+    return frames[mask].reshape(-1)
+
+class StreamingResampler:
+    """Chunked resampling that matches a one-shot ``Resample`` of the whole signal.
+
+    Each step resamples a window padded with enough real context on both
+    sides to cover the sinc kernel; window edges are multiples of the reduced
+    input rate so output samples line up exactly with the one-shot result.
+    """
+
+    def __init__(self, orig_fs: int, new_fs: int, block: int = DECODE_BLOCK_FRAMES):
+        g = math.gcd(orig_fs, new_fs)
+        self.o, self.n = orig_fs // g, new_fs // g
+        self.resampler = get_resampler(orig_fs, new_fs)
+        self.ctx = (math.ceil(self.resampler.width / self.o) + 1) * self.o
+        self.step = self.o * max(1, block // self.o)
+        self.buf = np.zeros(0, dtype=np.float32)
+        self.hist = 0  # leading samples of buf already emitted, kept as left context
+
+    def _resample(self, window: np.ndarray) -> np.ndarray:
+        return self.resampler(torch.from_numpy(window).unsqueeze(0)).squeeze(0).numpy()
+
+    def feed(self, x: np.ndarray) -> np.ndarray:
+        self.buf = np.concatenate([self.buf, x.astype(np.float32, copy=False)])
+        out = []
+        while len(self.buf) - self.hist >= self.step + self.ctx:
+            y = self._resample(self.buf[:self.hist + self.step + self.ctx])
+            start = self.hist // self.o * self.n
+            out.append(y[start:start + self.step // self.o * self.n])
+            consumed = self.hist + self.step
+            keep_from = max(0, consumed - self.ctx)
+            self.buf = self.buf[keep_from:]
+            self.hist = consumed - keep_from
+        return np.concatenate(out) if out else np.zeros(0, dtype=np.float32)
+
+    def flush(self) -> np.ndarray:
+        rest = len(self.buf) - self.hist
+        if rest <= 0:
+            return np.zeros(0, dtype=np.float32)
+        y = self._resample(self.buf)
+        start = self.hist // self.o * self.n
+        out = y[start:start + math.ceil(rest * self.n / self.o)]
+        self.buf, self.hist = np.zeros(0, dtype=np.float32), 0
+        return out
+
+
+class StreamingVAD:
+    """Frame-by-frame VAD that keeps only voiced frames, with hangover carried across chunks."""
+
+    def __init__(self, fs: int = 16000, frame_ms: int = 30, hangover: int = None):
+        self.fs = fs
+        self.frame_ms = frame_ms
+        self.frame_len = int(fs * frame_ms / 1000)
+        self.hangover = VAD_HANGOVER_FRAMES if hangover is None else hangover
+        self.vad = webrtcvad.Vad(VAD_MODE)
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.voiced = []
+        self._hang_left = 0
+
+    def feed(self, x: np.ndarray):
+        if len(self.pending):
+            x = np.concatenate([self.pending, x])
+        n_frames = len(x) // self.frame_len
+        self.pending = x[n_frames * self.frame_len:].copy()
+        if n_frames == 0:
+            return
+        mask = speech_mask(x[:n_frames * self.frame_len], self.fs, self.frame_ms, self.vad)
+        if self.hangover:
+            hits = np.flatnonzero(mask)
+            smoothed = smooth_mask(mask, self.hangover).copy()
+            smoothed[:self._hang_left] = True
+            if hits.size:
+                self._hang_left = max(0, self.hangover - (n_frames - 1 - hits[-1]))
+            else:
+                self._hang_left = max(0, self._hang_left - n_frames)
+            mask = smoothed
+        if mask.any():
+            frames = x[:n_frames * self.frame_len].reshape(n_frames, self.frame_len)
+            self.voiced.append(frames[mask].reshape(-1))
+
+    def speech(self) -> np.ndarray:
+        # the trailing partial frame is dropped, as in extract_speech
+        return np.concatenate(self.voiced) if self.voiced else np.zeros(0, dtype=np.float32)
+
+
+def _load_speech_buffered(data: bytes, timings: dict) -> np.ndarray:
+    t0 = time.perf_counter()
+    wav, fs = torchaudio.load(io.BytesIO(data))     # wav: [channels, time]
+    mono = wav.mean(dim=0, keepdim=True)
+    t1 = time.perf_counter()
+    wav16k = ensure_16k(mono, fs)
+    t2 = time.perf_counter()
+    speech = extract_speech(wav16k.squeeze(0).numpy())
+    timings["decode"] = timings.get("decode", 0.0) + t1 - t0
+    timings["resample"] = timings.get("resample", 0.0) + t2 - t1
+    timings["vad"] = timings.get("vad", 0.0) + time.perf_counter() - t2
+    return speech
+
+def load_speech(src, timings: dict = None) -> np.ndarray:
+    """Decode an uploaded clip, downmix, resample to 16 kHz and keep voiced frames.
+
+    ``src`` is raw bytes or a seekable binary file (e.g. ``UploadFile.file``).
+    Audio is decoded block by block so peak memory is bounded by the block size
+    plus the retained speech, not by the clip length. Formats libsndfile cannot
+    read fall back to a full torchaudio decode. If ``timings`` is given, seconds
+    spent in ``decode``, ``resample`` and ``vad`` are added to it.
+    """
+    timings = {} if timings is None else timings
+    for stage in ("decode", "resample", "vad"):
+        timings.setdefault(stage, 0.0)
+    if isinstance(src, (bytes, bytearray)):
+        src = io.BytesIO(src)
+    try:
+        snd = sf.SoundFile(src)
+    except RuntimeError:
+        src.seek(0)
+        return _load_speech_buffered(src.read(), timings)
+    vad_stream = StreamingVAD()
+    clock = time.perf_counter
+    with snd:
+        resampler = StreamingResampler(snd.samplerate, 16000) if snd.samplerate != 16000 else None
+        blocks = snd.blocks(blocksize=DECODE_BLOCK_FRAMES, dtype="float32", always_2d=True)
+        t0 = clock()
+        for block in blocks:
+            mono = block.mean(axis=1)
+            t1 = clock()
+            if resampler:
+                mono = resampler.feed(mono)
+            t2 = clock()
+            vad_stream.feed(mono)
+            t3 = clock()
+            timings["decode"] += t1 - t0
+            timings["resample"] += t2 - t1
+            timings["vad"] += t3 - t2
+            t0 = t3
+        if resampler:
+            t1 = clock()
+            tail = resampler.flush()
+            t2 = clock()
+            vad_stream.feed(tail)
+            timings["resample"] += t2 - t1
+            timings["vad"] += clock() - t2
+    return vad_stream.speech()
+
+def load_speech_timed(src):
+    """``load_speech`` plus its per-stage timings; picklable for process-pool workers."""
+    timings = {}
+    return load_speech(src, timings), timings
@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+from utils.workers import PoolSaturated
+
+
+class MicroBatcher:
+    """Coalesce concurrent requests into batched calls of a blocking function.
+
+    ``fn`` takes a list of items and returns a list of results in the same
+    order. Callers ``await submit(item)``; the first item of a batch waits at
+    most ``max_wait_ms`` for company before the batch is dispatched. Batches
+    run on ``pool`` (a :class:`utils.workers.WorkerPool`) when one is given,
+    otherwise on the loop's default executor.
+
+    At most ``max_queue`` items wait for a batch (by default ``max_batch``
+    per queue slot of ``pool``, unbounded without a pool); beyond that
+    ``submit`` raises :class:`PoolSaturated` instead of queueing.
+    """
+
+    def __init__(self, fn, max_batch=16, max_wait_ms=5.0, pool=None, stage="batch", max_queue=None):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.pool = pool
+        self.stage = stage
+        if max_queue is None:
+            max_queue = pool.max_queue * max_batch if pool is not None else 0
+        self.max_queue = max_queue
+        self.batches = 0
+        self.items = 0
+        self.rejected = 0
+        self._queue = None
+        self._task = None
+
+    async def submit(self, item):
+        self._ensure_running()
+        fut = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((item, fut))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise PoolSaturated(f"{self.stage} queue full ({self._queue.qsize()} items waiting)")
+        return await fut
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.get_running_loop().create_task(self._worker())
+
+    async def _collect(self):
+        item, fut = await self._queue.get()
+        batch = [(item, fut)]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # drop requests whose callers have gone away (e.g. client disconnect)
+            batch = [(item, fut) for item, fut in batch if not fut.cancelled()]
+            if not batch:
+                continue
+            items = [item for item, _ in batch]
+            try:
+                if self.pool is not None:
+                    results = await self.pool.run(self.stage, self.fn, items)
+                else:
+                    results = await loop.run_in_executor(None, self.fn, items)
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, fut), res in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(res)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+        }
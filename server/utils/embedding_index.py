@@ -0,0 +1,364 @@
+import os
+import logging
+import threading
+import numpy as np
+
+try:
+    import faiss
+except ImportError:  # FAISS backends are optional
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+SEARCH_BACKEND = os.getenv("VISTA_SEARCH_BACKEND", "numpy")  # numpy | faiss-flat | faiss-ivf | faiss-hnsw
+INDEX_DIR = os.getenv("VISTA_INDEX_DIR", "indexes")
+SAVE_EVERY = int(os.getenv("VISTA_INDEX_SAVE_EVERY", "50"))  # upserts between snapshots
+
+
+def normalize(emb) -> np.ndarray:
+    vec = np.asarray(emb, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+
+class NumpyIndex:
+    """Exact cosine search over a resident matrix of L2-normalized embeddings.
+
+    Rows are kept pre-normalized as float32 so that scoring a probe against
+    every enrolled identity is a single matrix-vector product. This class is
+    also the source of truth that the approximate backends are built from.
+    """
+
+    backend = "numpy"
+
+    def __init__(self, dim=None, initial_capacity=64, path=None):
+        self.dim = dim
+        self.path = path
+        self.ids = []
+        self.positions = {}
+        self._data = np.empty((initial_capacity, dim or 0), dtype=np.float32)
+        self._lock = threading.Lock()
+        self._unsaved = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._data[:len(self.ids)]
+
+    def load(self, rows):
+        """Bulk load ``(id, blob)`` rows, e.g. straight from a SQLite cursor."""
+        ids, vecs = [], []
+        for key, blob in rows:
+            ids.append(key)
+            vecs.append(normalize(np.frombuffer(blob, dtype=np.float32)))
+        with self._lock:
+            self._reset(ids, np.stack(vecs) if vecs else None)
+
+    def _reset(self, ids, data):
+        if data is None:
+            self.ids, self.positions = [], {}
+            return
+        self.dim = data.shape[1]
+        self._data = np.ascontiguousarray(data, dtype=np.float32)
+        self.ids = list(ids)
+        self.positions = {key: i for i, key in enumerate(self.ids)}
+
+    def sync(self, rows):
+        """Reconcile with the database, upserting only rows that are missing or changed.
+
+        Ids that are no longer in ``rows`` (deleted users, a reset database)
+        must stop matching, so any removal rebuilds the index from ``rows``.
+        """
+        rows = list(rows)
+        live = {key for key, _ in rows}
+        removed = [key for key in self.ids if key not in live]
+        if removed:
+            logger.warning(f"Dropping {len(removed)} ids from the index that are no longer in the database")
+        if removed or not len(self):
+            self.load(rows)
+            if removed:
+                self.save()
+            return len(self) + len(removed)
+        changed = 0
+        for key, blob in rows:
+            vec = normalize(np.frombuffer(blob, dtype=np.float32))
+            pos = self.positions.get(key)
+            if pos is None or not np.allclose(self._data[pos], vec, atol=1e-6):
+                self.upsert(key, vec)
+                changed += 1
+        return changed
+
+    def upsert(self, key, emb):
+        """Insert or replace the embedding stored for ``key``."""
+        vec = normalize(emb)
+        with self._lock:
+            if self.dim is None or not self.ids:
+                self.dim = vec.shape[0]
+                if self._data.shape[1] != self.dim:
+                    self._data = np.empty((max(len(self._data), 1), self.dim), dtype=np.float32)
+            elif vec.shape[0] != self.dim:
+                raise ValueError(f"Embedding dim {vec.shape[0]} does not match index dim {self.dim}")
+
+            pos = self.positions.get(key)
+            if pos is None:
+                pos = len(self.ids)
+                if pos >= len(self._data):
+                    # grow geometrically so enrollments stay amortized O(1)
+                    grown = np.empty((max(2 * len(self._data), 1), self.dim), dtype=np.float32)
+                    grown[:pos] = self._data[:pos]
+                    self._data = grown
+                # the row is written before the id makes it visible to search
+                self._data[pos] = vec
+                self.ids.append(key)
+                self.positions[key] = pos
+            else:
+                self._data[pos] = vec
+        self._mark_dirty()
+        return vec
+
+    def search(self, probe, k=1):
+        """Return up to ``k`` ``(id, cosine_score)`` pairs, best first."""
+        probe = normalize(probe)
+        with self._lock:
+            n = len(self.ids)
+            if n == 0:
+                return []
+            # rows below n are fully written; later appends or a reload don't touch this view
+            ids, matrix = self.ids, self._data[:n]
+        scores = matrix @ probe
+        k = min(k, n)
+        if k < n:
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+        else:
+            top = np.argsort(-scores)
+        return [(ids[i], float(scores[i])) for i in top]
+
+    # --- Persistence ---
+    def _mark_dirty(self):
+        self._unsaved += 1
+        if self.path and self._unsaved >= SAVE_EVERY:
+            self.save()
+
+    def save(self, path=None):
+        path = path or self.path
+        if not path:
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._lock:
+            ids = np.array(self.ids, dtype=str)
+            matrix = self.matrix.copy()
+        tmp = f"{path}.tmp.npz"
+        np.savez(tmp, ids=ids, matrix=matrix)
+        os.replace(tmp, f"{path}.npz")
+        self._unsaved = 0
+
+    def restore(self, path=None) -> bool:
+        path = path or self.path
+        if not path or not os.path.exists(f"{path}.npz"):
+            return False
+        try:
+            snap = np.load(f"{path}.npz")
+            with self._lock:
+                self._reset(snap["ids"].tolist(), snap["matrix"] if len(snap["ids"]) else None)
+            return True
+        except Exception as e:
+            logger.warning(f"Could not restore index snapshot {path}: {e}")
+            return False
+
+
+class FaissIndex:
+    """Approximate cosine search on top of a FAISS inner-product index.
+
+    A :class:`NumpyIndex` holds the normalized vectors so the FAISS structure
+    can be rebuilt at any time. Replaced embeddings are tombstoned rather than
+    removed (HNSW cannot delete), and the index is rebuilt once tombstones
+    pile up or an IVF index has enough points to be trained.
+    """
+
+    def __init__(self, kind="hnsw", path=None, nlist=1024, nprobe=16, hnsw_m=32, ef_search=64):
+        if faiss is None:
+            raise RuntimeError("faiss is not installed")
+        self.kind = kind
+        self.backend = f"faiss-{kind}"
+        self.path = path
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.store = NumpyIndex()
+        self.index = None
+        self.trained_ivf = False
+        self.label_keys = []   # faiss label -> user id
+        self.key_labels = {}   # user id -> live faiss label
+        self.stale = set()
+        self._lock = threading.Lock()
+        self._unsaved = 0
+
+    def __len__(self):
+        return len(self.store)
+
+    def _new_index(self, dim, n):
+        if self.kind == "hnsw":
+            inner = faiss.IndexHNSWFlat(dim, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            inner.hnsw.efSearch = self.ef_search
+            self.trained_ivf = False
+        elif self.kind == "ivf" and n >= 39 * self.nlist:
+            quantizer = faiss.IndexFlatIP(dim)
+            inner = faiss.IndexIVFFlat(quantizer, dim, self.nlist, faiss.METRIC_INNER_PRODUCT)
+            inner.train(self.store.matrix)
+            inner.nprobe = self.nprobe
+            self.trained_ivf = True
+        else:
+            # exact until an IVF index has enough points to train on
+            inner = faiss.IndexFlatIP(dim)
+            self.trained_ivf = False
+        return faiss.IndexIDMap2(inner)
+
+    def rebuild(self):
+        with self._lock:
+            matrix = self.store.matrix
+            n = len(self.store)
+            if n == 0:
+                self.index, self.label_keys, self.key_labels = None, [], {}
+                self.stale.clear()
+                return
+            self.index = self._new_index(matrix.shape[1], n)
+            self.index.add_with_ids(matrix, np.arange(n, dtype=np.int64))
+            self.label_keys = list(self.store.ids)
+            self.key_labels = {key: i for i, key in enumerate(self.label_keys)}
+            self.stale.clear()
+
+    def _needs_rebuild(self):
+        n = len(self.store)
+        if len(self.stale) > max(1000, n // 10):
+            return True
+        return self.kind == "ivf" and not self.trained_ivf and n >= 39 * self.nlist
+
+    def load(self, rows):
+        self.store.load(rows)
+        self.rebuild()
+
+    def sync(self, rows):
+        if self.index is None:
+            self.load(rows)
+            return len(self)
+        changed = self.store.sync(rows)
+        if changed:
+            self.rebuild()
+            self.save()
+        return changed
+
+    def upsert(self, key, emb):
+        vec = self.store.upsert(key, emb)
+        if self.index is None:
+            self.rebuild()
+        else:
+            with self._lock:
+                old = self.key_labels.get(key)
+                if old is not None:
+                    self.stale.add(old)
+                label = len(self.label_keys)
+                self.label_keys.append(key)
+                self.key_labels[key] = label
+                self.index.add_with_ids(vec.reshape(1, -1), np.array([label], dtype=np.int64))
+            if self._needs_rebuild():
+                self.rebuild()
+        self._unsaved += 1
+        if self.path and self._unsaved >= SAVE_EVERY:
+            self.save()
+        return vec
+
+    def search(self, probe, k=1):
+        if self.index is None:
+            return []
+        q = normalize(probe).reshape(1, -1)
+        with self._lock:
+            k_eff = min(k + len(self.stale), len(self.label_keys))
+            scores, labels = self.index.search(q, k_eff)
+            label_keys, stale = self.label_keys, self.stale
+            hits = [
+                (label_keys[l], float(s))
+                for s, l in zip(scores[0], labels[0])
+                if l >= 0 and l not in stale
+            ]
+        return hits[:k]
+
+    def save(self, path=None):
+        path = path or self.path
+        if not path:
+            return
+        self.store.save(path)
+        with self._lock:
+            if self.index is None:
+                return
+            tmp = f"{path}.tmp.faiss"
+            faiss.write_index(self.index, tmp)
+            np.savez(f"{path}.labels.tmp.npz",
+                     label_keys=np.array(self.label_keys, dtype=str),
+                     stale=np.array(sorted(self.stale), dtype=np.int64))
+        os.replace(tmp, f"{path}.faiss")
+        os.replace(f"{path}.labels.tmp.npz", f"{path}.labels.npz")
+        self._unsaved = 0
+
+    def restore(self, path=None) -> bool:
+        path = path or self.path
+        if not path or not self.store.restore(path):
+            return False
+        try:
+            index = faiss.read_index(f"{path}.faiss")
+            labels = np.load(f"{path}.labels.npz")
+        except Exception as e:
+            logger.info(f"No usable FAISS snapshot at {path}, rebuilding: {e}")
+            self.rebuild()
+            return True
+        with self._lock:
+            self.index = index
+            self.label_keys = labels["label_keys"].tolist()
+            self.stale = set(labels["stale"].tolist())
+            self.key_labels = {}
+            for label, key in enumerate(self.label_keys):
+                if label not in self.stale:
+                    self.key_labels[key] = label
+            inner = faiss.downcast_index(index.index)
+            self.trained_ivf = isinstance(inner, faiss.IndexIVF)
+            if self.trained_ivf:
+                inner.nprobe = self.nprobe
+            elif isinstance(inner, faiss.IndexHNSW):
+                inner.hnsw.efSearch = self.ef_search
+            kind_matches = isinstance(inner, faiss.IndexHNSW) == (self.kind == "hnsw")
+        if not kind_matches or set(self.key_labels) != set(self.store.ids):
+            self.rebuild()
+        return True
+
+
+def create_index(name, backend=None, index_dir=None):
+    """Build the search backend selected by ``VISTA_SEARCH_BACKEND``.
+
+    The index is restored from its snapshot under ``VISTA_INDEX_DIR`` when one
+    exists; callers should still ``sync`` it against the database.
+    """
+    backend = (backend or SEARCH_BACKEND).lower()
+    path = os.path.join(index_dir or INDEX_DIR, name)
+    if backend.startswith("faiss"):
+        if faiss is None:
+            logger.warning(f"{backend} requested for '{name}' but faiss is not installed, using numpy")
+            index = NumpyIndex(path=path)
+        else:
+            kind = backend.split("-", 1)[1] if "-" in backend else "hnsw"
+            index = FaissIndex(
+                kind=kind,
+                path=path,
+                nlist=int(os.getenv("VISTA_FAISS_NLIST", "1024")),
+                nprobe=int(os.getenv("VISTA_FAISS_NPROBE", "16")),
+                hnsw_m=int(os.getenv("VISTA_FAISS_HNSW_M", "32")),
+                ef_search=int(os.getenv("VISTA_FAISS_EF_SEARCH", "64")),
+            )
+    elif backend == "numpy":
+        index = NumpyIndex(path=path)
+    else:
+        raise ValueError(f"Unknown search backend: {backend}")
+    index.restore()
+    return index
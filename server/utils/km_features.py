@@ -0,0 +1,133 @@
+import os
+
+import numpy as np
+
+# Stored as small integers in km_events.event_type
+EVENT_TYPES = ("move", "click_down", "click_up", "scroll", "key_down", "key_up")
+EVENT_CODES = {name: code for code, name in enumerate(EVENT_TYPES)}
+UNKNOWN_EVENT = -1
+BUTTON_CODES = {"Button.left": 1, "Button.right": 2, "Button.middle": 3}
+
+# Lookup tables indexed by event code; the extra last slot catches UNKNOWN_EVENT (-1)
+IS_CLICK = np.zeros(len(EVENT_TYPES) + 1, dtype=np.float32)
+IS_CLICK[[EVENT_CODES["click_down"], EVENT_CODES["click_up"]]] = 1
+IS_KEY = np.zeros(len(EVENT_TYPES) + 1, dtype=np.float32)
+IS_KEY[[EVENT_CODES["key_down"], EVENT_CODES["key_up"]]] = 1
+
+# Coordinates are normalized by the agents' screen size
+SCREEN_WIDTH = float(os.getenv("VISTA_SCREEN_WIDTH", "1920"))
+SCREEN_HEIGHT = float(os.getenv("VISTA_SCREEN_HEIGHT", "1080"))
+
+# Column order of a materialized window
+WINDOW_COLUMNS = ("timestamp", "event_type", "x", "y", "key_code", "button", "dx", "dy")
+T, ET, X, Y, KEY, BUTTON, DX, DY = range(len(WINDOW_COLUMNS))
+
+KM_EVENTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS km_events(
+    id INTEGER PRIMARY KEY,
+    device_id TEXT,
+    timestamp REAL,
+    event_type INTEGER,
+    x REAL,
+    y REAL,
+    key_code REAL,
+    button INTEGER,
+    dx REAL,
+    dy REAL
+)"""
+
+INSERT_KM_EVENT = (
+    "INSERT INTO km_events(device_id,timestamp,event_type,x,y,key_code,button,dx,dy) "
+    "VALUES (?,?,?,?,?,?,?,?,?)"
+)
+
+SELECT_WINDOW = (
+    "SELECT timestamp, event_type, COALESCE(x,0), COALESCE(y,0), COALESCE(key_code,0), "
+    "COALESCE(button,0), COALESCE(dx,0), COALESCE(dy,0) FROM km_events "
+    "WHERE device_id=? ORDER BY timestamp DESC LIMIT ?"
+)
+
+# One-off copy of legacy JSON rows into the typed table
+MIGRATE_RAW_EVENTS = """
+INSERT INTO km_events(device_id,timestamp,event_type,x,y,key_code,button,dx,dy)
+SELECT device_id, timestamp,
+    CASE event_type {cases} ELSE {unknown} END,
+    json_extract(data,'$.x'), json_extract(data,'$.y'), json_extract(data,'$.key_code'),
+    CASE json_extract(data,'$.button') {buttons} ELSE NULL END,
+    json_extract(data,'$.dx'), json_extract(data,'$.dy')
+FROM raw_events
+""".format(
+    cases=" ".join(f"WHEN '{name}' THEN {code}" for name, code in EVENT_CODES.items()),
+    unknown=UNKNOWN_EVENT,
+    buttons=" ".join(f"WHEN '{name}' THEN {code}" for name, code in BUTTON_CODES.items()),
+)
+
+
+def _num(v):
+    return float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else None
+
+
+def encode_events(device_id, events):
+    """Rows for INSERT_KM_EVENT from agent events ``{"timestamp", "event_type", "data"}``."""
+    rows = []
+    for ev in events:
+        d = ev["data"] or {}
+        rows.append((
+            device_id,
+            ev["timestamp"],
+            EVENT_CODES.get(ev["event_type"], UNKNOWN_EVENT),
+            _num(d.get("x")),
+            _num(d.get("y")),
+            _num(d.get("key_code")),
+            BUTTON_CODES.get(d.get("button")),
+            _num(d.get("dx")),
+            _num(d.get("dy")),
+        ))
+    return rows
+
+
+def load_window(conn, device_id, window_size=200) -> np.ndarray:
+    """The device's newest ``window_size`` events, oldest first, as an (n, 8) float array."""
+    rows = conn.execute(SELECT_WINDOW, (device_id, window_size)).fetchall()
+    if not rows:
+        return np.empty((0, len(WINDOW_COLUMNS)))
+    return np.array(rows, dtype=np.float64)[::-1]
+
+
+def events_window(rows) -> np.ndarray:
+    """The (n, 8) window layout for rows built by :func:`encode_events`."""
+    if not rows:
+        return np.empty((0, len(WINDOW_COLUMNS)))
+    window = np.array([r[1:] for r in rows], dtype=np.float64)
+    return np.nan_to_num(window, nan=0.0)  # missing fields read as 0, as in SELECT_WINDOW
+
+
+def window_features(window: np.ndarray, prev_t=None, screen=None, by_type=False) -> np.ndarray:
+    """Model input rows ``[is_click, is_key, delta_t, x, y, key]`` for a window.
+
+    ``prev_t`` is the timestamp of the event just before the window; without
+    it the first row's delta is 0. ``screen`` is the ``(width, height)`` used to
+    normalize coordinates. With ``by_type`` coordinates are kept only for
+    clicks and key codes only for key events, as KMStress has always fed them.
+    """
+    width, height = screen or (SCREEN_WIDTH, SCREEN_HEIGHT)
+    codes = window[:, ET].astype(np.intp)
+    is_click = IS_CLICK[codes]
+    is_key = IS_KEY[codes]
+    feats = np.empty((len(window), 6), dtype=np.float32)
+    feats[:, 0] = is_click
+    feats[:, 1] = is_key
+    feats[:, 2] = np.diff(window[:, T], prepend=window[:1, T] if prev_t is None else prev_t)
+    feats[:, 3:6] = window[:, X:BUTTON] / (width, height, 255)
+    if by_type:
+        feats[:, 3:5] *= is_click[:, None]
+        feats[:, 5] *= is_key
+    return feats
+
+
+def load_features(conn, device_id, window_size=200, **kwargs):
+    """``window_features`` of the device's newest events, or None if it has none."""
+    window = load_window(conn, device_id, window_size)
+    if not len(window):
+        return None
+    return window_features(window, **kwargs)
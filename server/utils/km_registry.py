@@ -0,0 +1,153 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceModel:
+    """A device's autoencoder plus its optimizer; ``lock`` guards both."""
+
+    def __init__(self, device_id, model, optimizer):
+        self.device_id = device_id
+        self.model = model
+        self.optimizer = optimizer
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.steps = 0
+        self.nbytes = 0
+        self.users = 0
+        self.last_used = time.time()
+
+
+def _state_bytes(model):
+    n = sum(p.numel() * p.element_size() for p in model.parameters())
+    # weights plus Adam's two moment buffers per parameter
+    return 3 * n
+
+
+class ModelRegistry:
+    """Lazily loaded per-device models with LRU eviction to state_dict snapshots.
+
+    At most ``max_resident`` models (and ``max_bytes`` of parameters plus
+    optimizer state, if set) are kept in memory. Evicted models are written to
+    ``snapshot_dir`` when they have trained since their last snapshot and are
+    restored transparently on next use.
+    """
+
+    def __init__(self, build, snapshot_dir="km_models", max_resident=256, max_bytes=None):
+        self.build = build
+        self.snapshot_dir = snapshot_dir
+        self.max_resident = max_resident
+        self.max_bytes = max_bytes
+        self.models = OrderedDict()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.loads = 0
+        self.creates = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(snapshot_dir, exist_ok=True)
+
+    def snapshot_path(self, device_id):
+        name = hashlib.sha1(device_id.encode()).hexdigest()
+        return os.path.join(self.snapshot_dir, f"{name}.pt")
+
+    @contextmanager
+    def use(self, device_id):
+        """Check out a device's model, holding its lock; it cannot be evicted meanwhile."""
+        with self._lock:
+            entry = self.models.get(device_id)
+            if entry is not None:
+                self.models.move_to_end(device_id)
+                self.hits += 1
+            else:
+                entry = self._load(device_id)
+                self.models[device_id] = entry
+                self.resident_bytes += entry.nbytes
+            entry.users += 1
+            entry.last_used = time.time()
+            self._evict()
+        try:
+            with entry.lock:
+                yield entry
+        finally:
+            with self._lock:
+                entry.users -= 1
+
+    def _load(self, device_id):
+        model, optimizer = self.build()
+        entry = DeviceModel(device_id, model, optimizer)
+        path = self.snapshot_path(device_id)
+        if os.path.exists(path):
+            try:
+                snap = torch.load(path, map_location="cpu")
+                model.load_state_dict(snap["model"])
+                optimizer.load_state_dict(snap["optimizer"])
+                entry.steps = snap.get("steps", 0)
+                self.loads += 1
+            except Exception as e:
+                logger.warning(f"Discarding unreadable KM snapshot for {device_id}: {e}")
+                self.creates += 1
+        else:
+            self.creates += 1
+        entry.nbytes = _state_bytes(model)
+        return entry
+
+    def _over_budget(self):
+        if len(self.models) > self.max_resident:
+            return True
+        return self.max_bytes is not None and self.resident_bytes > self.max_bytes
+
+    def _evict(self):
+        # oldest first; checked-out models are skipped and stay resident
+        for device_id in list(self.models):
+            if not self._over_budget():
+                break
+            entry = self.models[device_id]
+            if entry.users:
+                continue
+            if entry.dirty:
+                self._save(entry)
+            del self.models[device_id]
+            self.resident_bytes -= entry.nbytes
+            self.evictions += 1
+
+    def _save(self, entry):
+        path = self.snapshot_path(entry.device_id)
+        tmp = f"{path}.tmp"
+        torch.save({
+            "device_id": entry.device_id,
+            "model": entry.model.state_dict(),
+            "optimizer": entry.optimizer.state_dict(),
+            "steps": entry.steps,
+        }, tmp)
+        os.replace(tmp, path)
+        entry.dirty = False
+
+    def flush(self):
+        """Snapshot every resident model that has trained since it was last saved."""
+        with self._lock:
+            entries = list(self.models.values())
+        for entry in entries:
+            with entry.lock:
+                if entry.dirty:
+                    self._save(entry)
+
+    def stats(self):
+        return {
+            "resident": len(self.models),
+            "resident_mb": self.resident_bytes / 2**20,
+            "max_resident": self.max_resident,
+            "max_mb": self.max_bytes / 2**20 if self.max_bytes else None,
+            "hits": self.hits,
+            "loads": self.loads,
+            "creates": self.creates,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,160 @@
+import copy
+import logging
+import os
+import threading
+
+import numpy as np
+import torch
+
+try:
+    import onnxruntime as ort
+except ImportError:  # the ONNX runtime is optional
+    ort = None
+
+logger = logging.getLogger(__name__)
+
+RUNTIME_FORMATS = ("eager", "onnx")
+
+
+class ParityError(ValueError):
+    """An exported model disagrees with the eager model it was exported from."""
+
+
+def quantize(model):
+    """Inference copy of ``model`` with LSTM and Linear weights dynamically quantized to int8."""
+    return torch.ao.quantization.quantize_dynamic(
+        copy.deepcopy(model).eval(), {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8)
+
+
+def reconstruction_error(out, x):
+    return torch.mean((out - x) ** 2).item()
+
+
+def check_parity(reference, candidate, window_size=200, trials=4, atol=1e-5, rtol=None, seed=0):
+    """Compare ``candidate(x)`` against ``reference(x)`` on random windows.
+
+    Float exports must match outputs within ``atol``. Quantized exports are
+    not expected to reproduce outputs, so pass ``rtol`` instead to compare
+    reconstruction errors, the quantity scoring actually uses. Returns the
+    worst deviation seen; raises :class:`ParityError` past the tolerance.
+    """
+    gen = torch.Generator().manual_seed(seed)
+    worst = 0.0
+    with torch.inference_mode():
+        for _ in range(trials):
+            x = torch.rand(1, window_size, 6, generator=gen)
+            ref, got = reference(x), candidate(x)
+            if rtol is None:
+                worst = max(worst, (ref - got).abs().max().item())
+                limit = atol
+            else:
+                e_ref, e_got = reconstruction_error(ref, x), reconstruction_error(got, x)
+                worst = max(worst, abs(e_got - e_ref) / max(e_ref, 1e-12))
+                limit = rtol
+    if worst > limit:
+        raise ParityError(f"exported model deviates by {worst:.3g} (limit {limit:.3g})")
+    return worst
+
+
+def export_torchscript(model, path, quantized=False, window_size=200, rtol=0.05):
+    """Write a frozen, inference-only TorchScript copy of one device's model.
+
+    The artifact carries the weights and needs neither the model class nor
+    optimizer state to load, so a scoring-only process starts from it
+    directly. It is checked against the eager model before being written.
+    """
+    model = copy.deepcopy(model).eval()
+    inference = quantize(model) if quantized else model
+    scripted = torch.jit.freeze(torch.jit.script(inference))
+    if quantized:
+        check_parity(model, scripted, window_size, rtol=rtol)
+    else:
+        check_parity(model, scripted, window_size)
+    tmp = f"{path}.tmp"
+    torch.jit.save(scripted, tmp)
+    os.replace(tmp, path)
+    return path
+
+
+def load_torchscript(path):
+    return torch.jit.load(path, map_location="cpu").eval()
+
+
+class OnnxAutoencoder:
+    """One ONNX Runtime session that scores any device's autoencoder.
+
+    The graph is exported with its weights as overridable initializers, so
+    each call feeds the device's current parameters instead of needing an
+    export per device or per training step. The attention block bakes in the
+    input shape, so only single windows of exactly ``window_size`` rows are
+    accepted (``run`` raises ValueError for anything else); callers check
+    ``accepts`` and fall back to eager for shorter ones.
+    """
+
+    def __init__(self, path, template, window_size=200, threads=1):
+        self.path = path
+        self.window_size = window_size
+        if not os.path.exists(path):
+            self._export(template)
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+        self.weights = [i.name for i in self.session.get_overridable_initializers()]
+        check_parity(template.eval(), lambda x: torch.from_numpy(self.run(template, x)), window_size)
+
+    def _export(self, template):
+        tmp = f"{self.path}.tmp"
+        torch.onnx.export(
+            template.eval(),
+            (torch.zeros(1, self.window_size, 6),),
+            tmp,
+            input_names=["x"],
+            output_names=["y"],
+            # keep weights as named, overridable inputs rather than folded constants
+            keep_initializers_as_inputs=True,
+            do_constant_folding=False,
+            dynamo=False,
+        )
+        os.replace(tmp, self.path)
+
+    def accepts(self, x):
+        return tuple(x.shape[-2:]) == (self.window_size, 6) and x.numel() == self.window_size * 6
+
+    def run(self, model, x):
+        if not self.accepts(x):
+            raise ValueError(f"ONNX KM runtime takes one window of shape (1, {self.window_size}, 6), "
+                             f"got {tuple(x.shape)}")
+        state = model.state_dict()
+        feed = {name: state[name].detach().numpy() for name in self.weights}
+        feed["x"] = np.ascontiguousarray(x.reshape(1, self.window_size, 6), dtype=np.float32)
+        return self.session.run(None, feed)[0]
+
+
+_runtime_lock = threading.Lock()
+_runtimes = {}
+
+
+def get_runtime(kind, model_dir, build, window_size=200):
+    """The shared scoring runtime for ``kind``, or None for eager scoring.
+
+    Built on first use; an unavailable runtime logs a warning and falls back
+    to eager.
+    """
+    if kind == "eager":
+        return None
+    if kind not in RUNTIME_FORMATS:
+        raise ValueError(f"Unknown KM runtime '{kind}', expected one of {RUNTIME_FORMATS}")
+    with _runtime_lock:
+        key = (kind, model_dir, window_size)
+        if key not in _runtimes:
+            path = os.path.join(model_dir, f"autoencoder-{window_size}.onnx")
+            if ort is None:
+                logger.warning(f"KM runtime '{kind}' requested but onnxruntime is not installed, using eager")
+                _runtimes[key] = None
+                return None
+            try:
+                _runtimes[key] = OnnxAutoencoder(path, build(), window_size)
+            except Exception as e:
+                logger.warning(f"Could not load ONNX KM runtime from {path}, using eager: {e}")
+                _runtimes[key] = None
+        return _runtimes[key]
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+
+from utils.workers import PoolSaturated
+
+logger = logging.getLogger(__name__)
+
+
+class TrainingScheduler:
+    """Background trainer driven by per-device dirty flags.
+
+    Ingest calls :meth:`mark_dirty`; every ``interval`` seconds the scheduler
+    takes the set of dirty devices and runs ``step(device_id, last_ts)`` for
+    each one on ``pool``. However many batches a device pushed during the
+    interval, it gets one training step. Results are kept in ``latest`` so
+    callers can read the most recent published score without waiting.
+
+    If ``score`` is given, the devices trained in a tick are then scored
+    together: ``score([(device_id, last_ts), ...])`` runs once per group of up
+    to ``score_batch`` devices and returns one result (or None) per device,
+    merged into ``latest``.
+    """
+
+    def __init__(self, step, pool, interval=1.0, stage="km_step",
+                 score=None, score_batch=64, score_stage="km_score"):
+        self.step = step
+        self.pool = pool
+        self.interval = interval
+        self.stage = stage
+        self.score = score
+        self.score_batch = score_batch
+        self.score_stage = score_stage
+        self.dirty = {}    # device_id -> newest event timestamp seen since last step
+        self.latest = {}   # device_id -> last result returned by step (and score)
+        self.ticks = 0
+        self.steps = 0
+        self.coalesced = 0
+        self.score_batches = 0
+        self.scored = 0
+        self._task = None
+
+    def mark_dirty(self, device_id, ts):
+        if device_id in self.dirty:
+            self.coalesced += 1
+            ts = max(ts, self.dirty[device_id])
+        self.dirty[device_id] = ts
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.error(f"KM training tick failed: {e}")
+
+    async def _run_one(self, device_id, ts):
+        try:
+            result = await self.pool.run(self.stage, self.step, device_id, ts)
+        except PoolSaturated:
+            # try again next tick, keeping any newer timestamp that arrived meanwhile
+            self.mark_dirty(device_id, ts)
+            return
+        except Exception as e:
+            logger.error(f"KM training failed for {device_id}: {e}")
+            return
+        self.steps += 1
+        if result is not None:
+            self.latest[device_id] = {**self.latest.get(device_id, {}), **result}
+            return device_id, ts
+
+    async def _score(self, items):
+        try:
+            results = await self.pool.run(self.score_stage, self.score, items)
+        except Exception as e:
+            # PoolSaturated included: the devices are rescored after their next step
+            logger.error(f"KM scoring failed for {len(items)} devices: {e}")
+            return
+        self.score_batches += 1
+        for (device_id, _), result in zip(items, results):
+            if result is not None:
+                self.scored += 1
+                self.latest[device_id] = {**self.latest.get(device_id, {}), **result}
+
+    async def tick(self):
+        if not self.dirty:
+            return
+        pending, self.dirty = self.dirty, {}
+        self.ticks += 1
+        items = list(pending.items())
+        width = max(1, self.pool.max_workers)
+        trained = []
+        for i in range(0, len(items), width):
+            done = await asyncio.gather(*(self._run_one(d, ts) for d, ts in items[i:i + width]))
+            trained.extend(item for item in done if item is not None)
+        if self.score is not None:
+            for i in range(0, len(trained), self.score_batch):
+                await self._score(trained[i:i + self.score_batch])
+
+    def stats(self):
+        return {
+            "dirty": len(self.dirty),
+            "ticks": self.ticks,
+            "steps": self.steps,
+            "coalesced_batches": self.coalesced,
+            "score_batches": self.score_batches,
+            "scored": self.scored,
+        }
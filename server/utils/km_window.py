@@ -0,0 +1,146 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+
+from utils.km_features import T, events_window, load_window, window_features
+
+N_FEATURES = 6
+
+
+class FeatureRing:
+    """The newest ``capacity`` feature rows of one device, oldest first.
+
+    Rows are written twice, ``capacity`` apart, so the live window is always
+    one contiguous slice of ``buf`` and can be handed to torch without a copy.
+    ``last_t`` is the timestamp of the newest row, so the delta-time chain
+    continues across batches.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buf = np.zeros((2 * capacity, N_FEATURES), dtype=np.float32)
+        self.start = 0
+        self.size = 0
+        self.last_t = None
+
+    def extend(self, window: np.ndarray):
+        """Append events in the (n, 8) window layout, already in timestamp order."""
+        if not len(window):
+            return
+        window = window[-self.capacity:]
+        feats = window_features(window, self.last_t)
+        k = len(feats)
+        pos = (self.start + self.size + np.arange(k)) % self.capacity
+        self.buf[pos] = feats
+        self.buf[pos + self.capacity] = feats
+        overflow = max(0, self.size + k - self.capacity)
+        self.start = (self.start + overflow) % self.capacity
+        self.size = min(self.size + k, self.capacity)
+        # the oldest row's predecessor has left the window
+        self.buf[self.start, 2] = 0.0
+        self.buf[self.start + self.capacity, 2] = 0.0
+        self.last_t = float(window[-1, T])
+
+    def view(self) -> np.ndarray:
+        return self.buf[self.start:self.start + self.size]
+
+
+class DeviceWindow:
+    """A device's ring plus rows pushed by ingest but not yet featurized."""
+
+    def __init__(self, capacity):
+        self.ring = None            # built from the DB on first use
+        self.capacity = capacity
+        self.pending = []
+        self.lock = threading.Lock()
+
+
+class WindowCache:
+    """Per-device feature windows kept in memory between training steps.
+
+    Ingest calls :meth:`push` with the rows it just committed; that only
+    queues them. The training step checks a window out with :meth:`use`,
+    which folds pending rows into the ring and yields a ``(1, n, 6)`` tensor
+    sharing the ring's memory. A device's window is read from the database the
+    first time it is used (so restarts and evictions cost one query) and again
+    whenever rows arrive older than what the ring already holds.
+    """
+
+    def __init__(self, window_size=200, max_devices=4096):
+        self.window_size = window_size
+        self.max_devices = max_devices
+        self.windows = OrderedDict()
+        self.hydrations = 0
+        self.appends = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def push(self, device_id, rows):
+        """Queue rows (as built by ``encode_events``) committed for ``device_id``."""
+        if not rows:
+            return
+        with self._lock:
+            entry = self.windows.get(device_id)
+            # not cached yet: the rows are in the DB and will be read on first use
+            if entry is not None:
+                entry.pending.append(events_window(rows))
+
+    def _entry(self, device_id):
+        with self._lock:
+            entry = self.windows.get(device_id)
+            if entry is None:
+                entry = self.windows[device_id] = DeviceWindow(self.window_size)
+            self.windows.move_to_end(device_id)
+            while len(self.windows) > self.max_devices:
+                self.windows.popitem(last=False)
+                self.evictions += 1
+            return entry
+
+    def _hydrate(self, conn, device_id, entry):
+        with self._lock:
+            entry.pending.clear()
+        ring = FeatureRing(entry.capacity)
+        ring.extend(load_window(conn, device_id, entry.capacity))
+        entry.ring = ring
+        self.hydrations += 1
+
+    def _drain(self, conn, device_id, entry):
+        with self._lock:
+            batches, entry.pending = entry.pending, []
+        if not batches:
+            return
+        window = np.concatenate(batches)
+        window = window[np.argsort(window[:, T], kind="stable")]
+        if entry.ring.last_t is not None and window[0, T] <= entry.ring.last_t:
+            # late or already-loaded rows: the DB has the authoritative order
+            self._hydrate(conn, device_id, entry)
+            return
+        entry.ring.extend(window)
+        self.appends += 1
+
+    @contextmanager
+    def use(self, conn, device_id):
+        """Yield the device's current window as a (1, n, 6) tensor, or None if it has no events.
+
+        The tensor aliases the ring, so it is only valid inside the block.
+        """
+        entry = self._entry(device_id)
+        with entry.lock:
+            if entry.ring is None:
+                self._hydrate(conn, device_id, entry)
+            else:
+                self._drain(conn, device_id, entry)
+            view = entry.ring.view()
+            yield torch.from_numpy(view).unsqueeze(0) if len(view) else None
+
+    def stats(self):
+        return {
+            "devices": len(self.windows),
+            "max_devices": self.max_devices,
+            "hydrations": self.hydrations,
+            "appends": self.appends,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,102 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds; sized for the PAM login path (tens of ms to a few s)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def _fmt(v):
+    return "+Inf" if v == float("inf") else repr(float(v))
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, one series per label set."""
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.series = {}   # label tuple -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            row = self.series.get(key)
+            if row is None:
+                row = self.series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    row[i] += 1
+            row[-2] += seconds
+            row[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self.series.items()}
+        for key, row in sorted(series.items()):
+            for bound, n in zip(self.buckets, row):
+                lines.append(f"{self.name}_bucket{_labels(key + (('le', _fmt(bound)),))} {n}")
+            lines.append(f"{self.name}_sum{_labels(key)} {row[-2]!r}")
+            lines.append(f"{self.name}_count{_labels(key)} {row[-1]}")
+        return lines
+
+
+def render_pool_stats(pools):
+    """Prometheus counters from :meth:`utils.workers.WorkerPool.stats` of each pool."""
+    fields = (
+        ("count", "vista_pool_jobs_total", "Jobs run per pool stage"),
+        ("errors", "vista_pool_errors_total", "Jobs that raised per pool stage"),
+        ("wait_total", "vista_pool_wait_seconds_total", "Time jobs spent queued per pool stage"),
+        ("run_total", "vista_pool_run_seconds_total", "Time jobs spent running per pool stage"),
+    )
+    lines = []
+    for attr, name, help in fields:
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} counter"]
+        for pool in pools:
+            for stage, st in sorted(pool.stages.items()):
+                lines.append(f"{name}{_labels((('pool', pool.name), ('stage', stage)))} {getattr(st, attr)!r}")
+    lines += ["# HELP vista_pool_rejected_total Jobs refused because the pool was saturated",
+              "# TYPE vista_pool_rejected_total counter"]
+    lines += [f"vista_pool_rejected_total{_labels((('pool', p.name),))} {p.rejected}" for p in pools]
+    lines += ["# HELP vista_pool_pending Jobs queued or running",
+              "# TYPE vista_pool_pending gauge"]
+    lines += [f"vista_pool_pending{_labels((('pool', p.name),))} {p.pending}" for p in pools]
+    return lines
+
+
+class RequestTiming:
+    """Stage durations of one request, recorded into ``histogram`` as they finish."""
+
+    def __init__(self, histogram, pipeline):
+        self.histogram = histogram
+        self.pipeline = pipeline
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.histogram.observe(seconds, pipeline=self.pipeline, stage=stage)
+
+    def update(self, timings):
+        for stage, seconds in timings.items():
+            self.add(stage, seconds)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def server_timing(self):
+        """``Server-Timing`` header value, durations in milliseconds."""
+        return ", ".join(f"{stage};dur={1000 * s:.2f}" for stage, s in self.stages.items())
@@ -0,0 +1,71 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Models are resolved from here only; nothing is downloaded at runtime
+PRETRAINED_DIR = os.getenv("VISTA_PRETRAINED_DIR", "pretrained_models")
+
+
+def local_model_path(name, pretrained_dir=None):
+    """Path of ``name`` under the pretrained-models directory, which must already exist."""
+    path = os.path.join(pretrained_dir or PRETRAINED_DIR, name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"Model '{name}' not found at {path}; models are not downloaded at runtime, "
+            f"place it under {pretrained_dir or PRETRAINED_DIR} (or set VISTA_PRETRAINED_DIR)")
+    return path
+
+
+class LazyModel:
+    """A model built by ``load()`` on first :meth:`get`, once, from any thread."""
+
+    def __init__(self, name, load):
+        self.name = name
+        self._load = load
+        self._model = None
+        self._lock = threading.Lock()
+        self.load_seconds = None
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def get(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    start = time.perf_counter()
+                    model = self._load()
+                    self.load_seconds = time.perf_counter() - start
+                    logger.info(f"Loaded {self.name} in {self.load_seconds:.2f}s")
+                    self._model = model
+        return self._model
+
+    def stats(self):
+        return {"loaded": self.loaded, "load_seconds": self.load_seconds}
+
+
+class StartupTimer:
+    """Wall-clock time between successive startup checkpoints, logged as they pass."""
+
+    def __init__(self, name):
+        self.name = name
+        self.phases = {}
+        self._start = self._last = time.perf_counter()
+
+    def mark(self, label):
+        """Record the time since the previous mark (or construction) under ``label``."""
+        now = time.perf_counter()
+        self.phases[label] = now - self._last
+        self._last = now
+        logger.info(f"{self.name} startup: {label} took {self.phases[label]:.3f}s")
+
+    def done(self):
+        self.phases["total"] = time.perf_counter() - self._start
+        logger.info(f"{self.name} startup finished in {self.phases['total']:.3f}s")
+
+    def stats(self):
+        return dict(self.phases)
@@ -0,0 +1,94 @@
+import base64
+import json
+
+# Rows per NDJSON chunk handed to the response
+NDJSON_CHUNK = 500
+
+
+def encode_cursor(*key):
+    """Opaque page token for the sort key of the last row returned."""
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(token):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Malformed page cursor: {token!r}")
+    if not isinstance(key, list):
+        raise ValueError(f"Malformed page cursor: {token!r}")
+    return key
+
+
+def scope_cursor(scope, token):
+    """Tag a page token with the ``scope`` (e.g. a resolution) its key belongs to."""
+    return encode_cursor(scope, *decode_cursor(token))
+
+
+def split_cursor(token):
+    """``(scope, token)`` for a token built by :func:`scope_cursor`."""
+    key = decode_cursor(token)
+    if len(key) < 2 or not isinstance(key[0], str):
+        raise ValueError(f"Malformed page cursor: {token!r}")
+    return key[0], encode_cursor(*key[1:])
+
+
+def keyset_query(columns, table, filters=(), cursor=None, limit=None, order_by=("timestamp", "id")):
+    """SELECT for one page of ``table`` in ascending ``order_by`` order.
+
+    ``filters`` are ``(clause, value)`` pairs, skipped when the value is None.
+    ``cursor`` resumes strictly after the row it was taken from, so pages
+    stay stable under concurrent inserts and cost the same at any depth. The
+    sort key columns are appended to the selected ``columns``.
+    """
+    clauses, params = [], []
+    for clause, value in filters:
+        if value is not None:
+            clauses.append(clause)
+            params.append(value)
+    if cursor is not None:
+        key = decode_cursor(cursor)
+        if len(key) != len(order_by):
+            raise ValueError(f"Malformed page cursor: {cursor!r}")
+        clauses.append(f"({', '.join(order_by)}) > ({', '.join('?' * len(key))})")
+        params += key
+    q = f"SELECT {', '.join(list(columns) + list(order_by))} FROM {table}"
+    if clauses:
+        q += " WHERE " + " AND ".join(clauses)
+    q += f" ORDER BY {', '.join(order_by)}"
+    if limit is not None:
+        q += " LIMIT ?"
+        params.append(limit)
+    return q, params
+
+
+def fetch_page(conn, columns, table, filters=(), cursor=None, limit=1000, order_by=("timestamp", "id")):
+    """``(rows, next_cursor)``; rows are dicts of ``columns``, next_cursor is None on the last page."""
+    q, params = keyset_query(columns, table, filters, cursor, limit + 1, order_by)
+    rows = conn.execute(q, params).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    n = len(columns)
+    next_cursor = encode_cursor(*rows[-1][n:]) if more else None
+    return [dict(zip(columns, r[:n])) for r in rows], next_cursor
+
+
+def iter_ndjson(connect, columns, q, params=()):
+    """Stream the rows of a ``keyset_query`` as newline-delimited JSON without materializing them.
+
+    The query is built by the caller, so a bad cursor is rejected before the
+    response starts rather than cutting a 200 stream short. ``connect()``
+    opens a connection owned by the generator, since the response is
+    produced after the handler has returned.
+    """
+    db = connect()
+    try:
+        cur = db.execute(q, params)
+        n = len(columns)
+        while True:
+            rows = cur.fetchmany(NDJSON_CHUNK)
+            if not rows:
+                break
+            yield "".join(json.dumps(dict(zip(columns, r[:n]))) + "\n" for r in rows)
+    finally:
+        db.close()
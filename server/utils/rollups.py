@@ -0,0 +1,132 @@
+import math
+import os
+import time
+
+# Rollup bucket widths in seconds, finest first
+RESOLUTIONS = {"minute": 60, "hour": 3600}
+# Ranges up to this long are served from raw rows; longer ones from the finest
+# rollup that stays under MAX_POINTS buckets per series
+RAW_MAX_SPAN = float(os.getenv("VISTA_ROLLUP_RAW_MAX_SPAN", "3600"))
+MAX_POINTS = int(os.getenv("VISTA_ROLLUP_MAX_POINTS", "1000"))
+
+# Per source table and resolution: the table to read, its columns and its
+# (unique) sort key
+SERIES = {
+    "anomalies": {
+        "raw": ("anomalies", ("device_id", "timestamp", "score"), ("timestamp", "id")),
+        **{res: (f"anomalies_{res}", ("device_id", "timestamp", "count", "score", "max_score"),
+                 ("timestamp", "device_id")) for res in RESOLUTIONS},
+    },
+    "voice_history": {
+        "raw": ("voice_history", ("pc_id", "user_id", "timestamp", "result", "score"), ("timestamp", "id")),
+        **{res: (f"voice_history_{res}", ("pc_id", "timestamp", "known", "unknown"),
+                 ("timestamp", "pc_id")) for res in RESOLUTIONS},
+    },
+}
+
+# Buckets are keyed by their start time; score is the running mean of the bucket
+_ANOMALY_ROLLUP = """
+CREATE TABLE IF NOT EXISTS anomalies_{res}(
+    device_id TEXT,
+    timestamp REAL,
+    count INTEGER,
+    score REAL,
+    max_score REAL,
+    PRIMARY KEY(device_id, timestamp)
+)"""
+_ANOMALY_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS anomalies_{res}_on_insert AFTER INSERT ON anomalies BEGIN
+    INSERT INTO anomalies_{res}(device_id, timestamp, count, score, max_score)
+    VALUES (NEW.device_id, CAST(NEW.timestamp / {secs} AS INTEGER) * {secs}, 1, NEW.score, NEW.score)
+    ON CONFLICT(device_id, timestamp) DO UPDATE SET
+        count = count + 1,
+        score = score + (excluded.score - score) / (count + 1),
+        max_score = MAX(max_score, excluded.max_score);
+END"""
+_ANOMALY_BACKFILL = """
+INSERT INTO anomalies_{res}(device_id, timestamp, count, score, max_score)
+SELECT device_id, CAST(timestamp / {secs} AS INTEGER) * {secs}, COUNT(*), AVG(score), MAX(score)
+FROM anomalies GROUP BY 1, 2"""
+
+_VOICE_ROLLUP = """
+CREATE TABLE IF NOT EXISTS voice_history_{res}(
+    pc_id TEXT,
+    timestamp REAL,
+    known INTEGER,
+    unknown INTEGER,
+    PRIMARY KEY(pc_id, timestamp)
+)"""
+_VOICE_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS voice_history_{res}_on_insert AFTER INSERT ON voice_history BEGIN
+    INSERT INTO voice_history_{res}(pc_id, timestamp, known, unknown)
+    VALUES (NEW.pc_id, CAST(NEW.timestamp / {secs} AS INTEGER) * {secs},
+            NEW.result = 'known', NEW.result = 'unknown')
+    ON CONFLICT(pc_id, timestamp) DO UPDATE SET
+        known = known + excluded.known,
+        unknown = unknown + excluded.unknown;
+END"""
+_VOICE_BACKFILL = """
+INSERT INTO voice_history_{res}(pc_id, timestamp, known, unknown)
+SELECT pc_id, CAST(timestamp / {secs} AS INTEGER) * {secs},
+       SUM(result = 'known'), SUM(result = 'unknown')
+FROM voice_history GROUP BY 1, 2"""
+
+_ROLLUP_SQL = {
+    "anomalies": (_ANOMALY_ROLLUP, _ANOMALY_TRIGGER, _ANOMALY_BACKFILL),
+    "voice_history": (_VOICE_ROLLUP, _VOICE_TRIGGER, _VOICE_BACKFILL),
+}
+
+
+def create_rollups(conn, *sources):
+    """Create the rollup tables of each source table and keep them current with triggers.
+
+    Every insert into a source updates its minute and hour buckets in the same
+    transaction, so the rollups never lag the raw rows. A rollup without its
+    trigger is rebuilt from the source rows first.
+    """
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for source in sources:
+            schema, trigger, backfill = _ROLLUP_SQL[source]
+            for res, secs in RESOLUTIONS.items():
+                table, _, order_by = SERIES[source][res]
+                conn.execute(schema.format(res=res))
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_ts ON {table}({', '.join(order_by)})")
+                has_trigger = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type='trigger' AND name=?",
+                    (f"{table}_on_insert",),
+                ).fetchone()
+                if not has_trigger:
+                    conn.execute(f"DELETE FROM {table}")
+                    conn.execute(backfill.format(res=res, secs=secs))
+                    conn.execute(trigger.format(res=res, secs=secs))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def pick_resolution(start=None, end=None, max_points=MAX_POINTS, raw_max_span=RAW_MAX_SPAN):
+    """Finest resolution that keeps ``[start, end]`` within ``max_points`` buckets per series.
+
+    Without a ``start`` there is no range to size, so raw rows are returned;
+    rollups are only chosen for an explicit range.
+    """
+    if start is None:
+        return "raw"
+    span = (end if end is not None else time.time()) - start
+    if span <= raw_max_span:
+        return "raw"
+    for res, secs in RESOLUTIONS.items():
+        if span / secs <= max_points:
+            return res
+    return res
+
+
+def bucket_start(ts, resolution):
+    """Start of the ``resolution`` bucket holding ``ts``, so range filters keep partial buckets."""
+    if ts is None or resolution == "raw":
+        return ts
+    secs = RESOLUTIONS[resolution]
+    return math.floor(ts / secs) * secs
@@ -0,0 +1,166 @@
+import logging
+import os
+
+import numpy as np
+import torch
+
+from utils.audio import load_speech
+
+logger = logging.getLogger(__name__)
+
+# Optional CPU serving optimizations for the SpeechBrain ECAPA encoder
+ECAPA_INT8 = os.getenv("VISTA_ECAPA_INT8", "0") == "1"
+ECAPA_TRACE = os.getenv("VISTA_ECAPA_TRACE", "0") == "1"
+TORCH_THREADS = int(os.getenv("VISTA_TORCH_THREADS", "0"))            # 0 = torch default
+TORCH_INTEROP_THREADS = int(os.getenv("VISTA_TORCH_INTEROP_THREADS", "0"))
+# "label enroll.wav probe.wav" per line (VoxCeleb trial-list format), paths relative to the file
+ECAPA_EVAL_PAIRS = os.getenv("VISTA_ECAPA_EVAL_PAIRS")
+ECAPA_MAX_EER_DELTA = float(os.getenv("VISTA_ECAPA_MAX_EER_DELTA", "0.005"))
+
+
+def tune_threads(threads=TORCH_THREADS, interop=TORCH_INTEROP_THREADS):
+    if threads:
+        torch.set_num_threads(threads)
+    if interop:
+        try:
+            torch.set_num_interop_threads(interop)
+        except RuntimeError:
+            # only settable before the first inter-op parallel work has started
+            logger.warning("torch inter-op thread count already fixed, leaving it as is")
+
+
+def encode(clf, sig, wav_lens=None):
+    """``clf.encode_batch`` without autograd bookkeeping."""
+    with torch.inference_mode():
+        return clf.encode_batch(sig, wav_lens=wav_lens)
+
+
+def _quantize(model):
+    quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    n = sum(isinstance(m, torch.ao.nn.quantized.dynamic.Linear) for m in quantized.modules())
+    if n == 0:
+        # ECAPA-TDNN is built from Conv1d blocks, which dynamic quantization does not cover
+        logger.warning("ECAPA int8: no Linear layers to quantize, weights stay fp32")
+    else:
+        logger.info(f"ECAPA int8: quantized {n} Linear layers")
+    return quantized
+
+
+def _trace(model, n_mels=80, frames=(300, 217)):
+    """Trace the embedding model, or return None if the trace does not generalize across lengths."""
+    example = torch.randn(1, frames[0], n_mels)
+    with torch.inference_mode():
+        traced = torch.jit.trace(model, (example, torch.ones(1)), check_trace=False)
+        traced = torch.jit.freeze(traced.eval())
+        for n in frames:
+            x = torch.randn(2, n, n_mels)
+            lens = torch.tensor([1.0, 0.6])
+            if not torch.allclose(traced(x, lens), model(x, lens), atol=1e-4):
+                return None
+    return traced
+
+
+def optimize_encoder(clf, int8=ECAPA_INT8, trace=ECAPA_TRACE):
+    """Apply the configured CPU serving optimizations to ``clf`` in place.
+
+    Thread counts come from ``VISTA_TORCH_THREADS``/``VISTA_TORCH_INTEROP_THREADS``;
+    ``int8`` dynamically quantizes Linear layers and ``trace`` swaps the
+    embedding model for a frozen TorchScript trace. A trace that bakes in the
+    input length is discarded with a warning.
+    """
+    tune_threads()
+    clf.mods.eval()
+    model = clf.mods.embedding_model
+    if int8:
+        model = _quantize(model)
+    if trace:
+        traced = _trace(model)
+        if traced is None:
+            logger.warning("ECAPA trace does not hold for other input lengths, keeping eager model")
+        else:
+            model = traced
+    clf.mods.embedding_model = model
+    return clf
+
+
+def read_pairs(path):
+    base = os.path.dirname(os.path.abspath(path))
+    pairs = []
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) != 3:
+                continue
+            label, enroll, probe = parts
+            pairs.append((int(label), os.path.join(base, enroll), os.path.join(base, probe)))
+    return pairs
+
+
+def equal_error_rate(scores, labels):
+    scores, labels = np.asarray(scores), np.asarray(labels, dtype=bool)
+    order = np.argsort(-scores)
+    labels = labels[order]
+    # sweep the threshold from the highest score down
+    fa = np.cumsum(~labels) / max((~labels).sum(), 1)
+    fr = 1 - np.cumsum(labels) / max(labels.sum(), 1)
+    i = np.argmin(np.abs(fa - fr))
+    return float((fa[i] + fr[i]) / 2)
+
+
+def load_clip(path):
+    with open(path, "rb") as f:
+        return load_speech(f)
+
+
+def pair_scores(clf, pairs, load=load_clip):
+    """Cosine score of every (enroll, probe) pair, embedding each clip once."""
+    cache = {}
+
+    def embed(path):
+        if path not in cache:
+            wav = load(path)
+            emb = encode(clf, torch.from_numpy(wav).unsqueeze(0)).reshape(-1).numpy()
+            cache[path] = emb / (np.linalg.norm(emb) or 1.0)
+        return cache[path]
+
+    return [float(embed(e) @ embed(p)) for _, e, p in pairs]
+
+
+def accuracy_report(base_scores, opt_scores, labels, max_eer_delta=ECAPA_MAX_EER_DELTA):
+    """EER of baseline vs optimized scores on the same labelled pairs.
+
+    ``passed`` is False when the optimized encoder's EER is worse than the
+    baseline's by more than ``max_eer_delta``.
+    """
+    base_eer = equal_error_rate(base_scores, labels)
+    opt_eer = equal_error_rate(opt_scores, labels)
+    return {
+        "pairs": len(labels),
+        "baseline_eer": base_eer,
+        "optimized_eer": opt_eer,
+        "max_score_drift": float(np.max(np.abs(np.subtract(base_scores, opt_scores)))) if labels else 0.0,
+        "passed": opt_eer - base_eer <= max_eer_delta,
+    }
+
+
+def load_optimized(clf, pairs_path=ECAPA_EVAL_PAIRS, load=load_clip, **kwargs):
+    """``optimize_encoder(clf)``, kept only if it passes the accuracy check on ``pairs_path``.
+
+    Clips go through the same decode/VAD path as uploads. Without a pairs
+    file the optimizations are applied unchecked; on a regression the
+    original fp32 embedding model is put back.
+    """
+    if not pairs_path:
+        return optimize_encoder(clf, **kwargs)
+    pairs = read_pairs(pairs_path)
+    labels = [label for label, _, _ in pairs]
+    original = clf.mods.embedding_model
+    base_scores = pair_scores(clf, pairs, load)
+    optimize_encoder(clf, **kwargs)
+    report = accuracy_report(base_scores, pair_scores(clf, pairs, load), labels)
+    if report["passed"]:
+        logger.info(f"ECAPA optimizations kept: {report}")
+    else:
+        logger.error(f"ECAPA optimizations regress accuracy, reverting to fp32: {report}")
+        clf.mods.embedding_model = original
+    return clf
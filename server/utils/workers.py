@@ -0,0 +1,118 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+
+
+class PoolSaturated(RuntimeError):
+    """Raised when a pool already holds ``max_workers + max_queue`` jobs."""
+
+
+def _timed_call(fn, args, kwargs):
+    # Module-level so it can be pickled into process pools.
+    started = time.time()
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, started, time.perf_counter() - t0
+
+
+def _init_process_worker():
+    # Forked workers share the parent's CPUs; keep torch from oversubscribing them.
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+
+
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.wait_total = 0.0
+        self.run_total = 0.0
+        self.run_max = 0.0
+
+    def record(self, wait, run, ok=True):
+        self.count += 1
+        self.errors += 0 if ok else 1
+        self.wait_total += wait
+        self.run_total += run
+        self.run_max = max(self.run_max, run)
+
+    def as_dict(self):
+        n = self.count or 1
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_wait_ms": 1000 * self.wait_total / n,
+            "mean_run_ms": 1000 * self.run_total / n,
+            "max_run_ms": 1000 * self.run_max,
+        }
+
+
+class WorkerPool:
+    """Bounded thread/process pool for CPU-bound request stages.
+
+    ``run`` rejects new work with :class:`PoolSaturated` once ``max_workers``
+    jobs are running and ``max_queue`` more are waiting, so callers can shed
+    load instead of letting latency grow without bound.
+    """
+
+    def __init__(self, name, kind="thread", max_workers=None, max_queue=32):
+        self.name = name
+        self.kind = kind
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        if kind == "process":
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=_init_process_worker,
+            )
+        elif kind == "thread":
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{name}-worker")
+        else:
+            raise ValueError(f"Unknown worker pool kind: {kind}")
+        self.pending = 0
+        self.rejected = 0
+        self.stages = {}
+
+    @property
+    def capacity(self):
+        return self.max_workers + self.max_queue
+
+    async def run(self, stage, fn, *args, **kwargs):
+        if self.pending >= self.capacity:
+            self.rejected += 1
+            raise PoolSaturated(f"{self.name} pool saturated ({self.pending} jobs in flight)")
+        self.pending += 1
+        submitted = time.time()
+        stats = self.stages.setdefault(stage, StageStats())
+        try:
+            loop = asyncio.get_running_loop()
+            result, started, elapsed = await loop.run_in_executor(
+                self.executor, partial(_timed_call, fn, args, kwargs)
+            )
+        except Exception:
+            stats.record(time.time() - submitted, 0.0, ok=False)
+            raise
+        finally:
+            self.pending -= 1
+        stats.record(max(0.0, started - submitted), elapsed)
+        return result
+
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "pending": self.pending,
+            "rejected": self.rejected,
+            "stages": {name: s.as_dict() for name, s in self.stages.items()},
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,213 @@
+"""Golden checks for the vectorized KM feature builder and the streaming voice preprocessing.
+
+The fixtures in golden/ were produced by the original per-row implementations,
+which are kept below as ``legacy_*``:
+
+- KM features must be bit-identical, both from encoded events and read back
+  through SQLite, for the server.py layout and KMStress's per-type layout.
+- Voice preprocessing (StreamingResampler + StreamingVAD behind load_speech)
+  must keep exactly the frames the old Resample + extract_speech path kept.
+  Samples may differ by float32 rounding, since each resampled window is
+  convolved separately.
+- The KM scoring runtimes must agree with the eager autoencoder on the golden
+  window: TorchScript and ONNX outputs within RUNTIME_ATOL, the int8 TorchScript
+  export's reconstruction error within QUANTIZED_RTOL. ONNX is skipped when
+  onnxruntime is not installed.
+
+Run from the repository root:
+    python testscripts/golden_check.py            # compare against golden/expected.npz
+    python testscripts/golden_check.py --update   # rewrite expected.npz from the legacy code
+"""
+import io
+import os
+import sys
+import json
+import sqlite3
+import tempfile
+
+import numpy as np
+import soundfile as sf
+import torch
+import webrtcvad
+from torchaudio.transforms import Resample
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GOLDEN = os.path.join(HERE, "golden")
+sys.path.insert(0, os.path.join(HERE, "..", "server"))
+# KMStress builds its model registry on import; keep its snapshots out of the tree
+os.environ.setdefault("VISTA_KM_MODEL_DIR", tempfile.mkdtemp(prefix="km_models-"))
+
+from utils.audio import load_speech, DECODE_BLOCK_FRAMES
+from utils.km_features import (KM_EVENTS_SCHEMA, INSERT_KM_EVENT, encode_events,
+                               events_window, window_features, load_features)
+from utils.km_runtime import OnnxAutoencoder, export_torchscript, load_torchscript, ort
+from models.KMStress import build_device_model
+
+DEVICE_ID = "golden-device"
+SAMPLE_ATOL = 1e-6
+RUNTIME_ATOL = 1e-5
+QUANTIZED_RTOL = 0.05
+KM_WINDOW = 200
+
+
+# --- Legacy reference implementations ---
+def legacy_features(events, by_type=False):
+    # server.py / KMStress.py load_sequences, minus the DB read and JSON decode
+    feats = []
+    prev_t = None
+    for ev in events:
+        t, et, d = ev["timestamp"], ev["event_type"], ev["data"]
+        delta = t - prev_t if prev_t else 0.0
+        prev_t = t
+        if by_type:
+            is_click, is_key = 0, 0
+            coords = [0.0, 0.0]
+            key = [0.0]
+            if et in ("click_down", "click_up"):
+                is_click = 1
+                coords = [d.get("x", 0)/1920, d.get("y", 0)/1080]
+            elif et in ("key_down", "key_up"):
+                is_key = 1
+                key = [d.get("key_code", 0)/255]
+            feats.append([is_click, is_key, delta] + coords + key)
+        else:
+            is_click = 1 if et in ("click_down", "click_up") else 0
+            is_key = 1 if et in ("key_down", "key_up") else 0
+            x = d.get("x", 0)/1920
+            y = d.get("y", 0)/1080
+            key = d.get("key_code", 0)/255
+            feats.append([is_click, is_key, delta, x, y, key])
+    return torch.tensor(feats, dtype=torch.float32).numpy()
+
+
+def legacy_speech(data):
+    # torchaudio.load decodes PCM_16 to the same float32 values soundfile returns
+    wav, fs = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+    wav = torch.from_numpy(wav.T.copy())
+    mono = wav.mean(dim=0, keepdim=True)
+    if fs != 16000:
+        mono = Resample(orig_freq=fs, new_freq=16000)(mono)
+    wav_np = mono.squeeze(0).numpy()
+    vad = webrtcvad.Vad(1)
+    frames = 480
+    speech, mask = [], []
+    for i in range(0, len(wav_np), frames):
+        frame = wav_np[i:i+frames]
+        if len(frame) < frames:
+            break
+        voiced = vad.is_speech((frame * 32768).astype(np.int16).tobytes(), 16000)
+        mask.append(voiced)
+        if voiced:
+            speech.extend(frame)
+    return np.array(speech, dtype=np.float32), np.array(mask, dtype=bool)
+
+
+# --- Current implementations ---
+def current_features(events, by_type=False):
+    return window_features(events_window(encode_events(DEVICE_ID, events)), by_type=by_type)
+
+
+def current_features_sqlite(events, by_type=False):
+    conn = sqlite3.connect(":memory:")
+    conn.execute(KM_EVENTS_SCHEMA)
+    conn.executemany(INSERT_KM_EVENT, encode_events(DEVICE_ID, events))
+    return load_features(conn, DEVICE_ID, window_size=len(events), by_type=by_type)
+
+
+def check_runtimes(events):
+    """Eager vs TorchScript/ONNX on the golden window; returns the number of failures."""
+    torch.manual_seed(0)
+    model = build_device_model()[0].eval()
+    x = torch.from_numpy(current_features(events[-KM_WINDOW:])).unsqueeze(0)
+    with torch.inference_mode():
+        ref = model(x)
+    ref_error = torch.mean((ref - x) ** 2).item()
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, quantized in (("torchscript", False), ("torchscript-int8", True)):
+            scripted = load_torchscript(export_torchscript(model, os.path.join(tmp, f"{name}.pt"), quantized))
+            with torch.inference_mode():
+                got = scripted(x)
+            if quantized:
+                dev = abs(torch.mean((got - x) ** 2).item() - ref_error) / ref_error
+                ok = dev <= QUANTIZED_RTOL
+            else:
+                dev = (got - ref).abs().max().item()
+                ok = dev <= RUNTIME_ATOL
+            failures += not ok
+            print(f"{'OK  ' if ok else 'FAIL'} km runtime {name}: deviation {dev:.3g}")
+
+        if ort is None:
+            print("SKIP km runtime onnx: onnxruntime is not installed")
+            return failures
+        runtime = OnnxAutoencoder(os.path.join(tmp, "autoencoder.onnx"), model, KM_WINDOW)
+        dev = float(np.abs(runtime.run(model, x) - ref.numpy()).max())
+        ok = dev <= RUNTIME_ATOL
+        try:
+            runtime.run(model, x[:, :KM_WINDOW // 2])
+            ok = False
+            print(f"FAIL km runtime onnx: a {KM_WINDOW // 2}-row window was not rejected")
+        except ValueError:
+            pass
+        failures += not ok
+        print(f"{'OK  ' if ok else 'FAIL'} km runtime onnx: deviation {dev:.3g}, short windows rejected")
+    return failures
+
+
+def read_inputs():
+    with open(os.path.join(GOLDEN, "km_events.json")) as f:
+        events = json.load(f)
+    with open(os.path.join(GOLDEN, "voice.wav"), "rb") as f:
+        audio = f.read()
+    return events, audio
+
+
+def update():
+    events, audio = read_inputs()
+    speech, mask = legacy_speech(audio)
+    np.savez(
+        os.path.join(GOLDEN, "expected.npz"),
+        km_features=legacy_features(events),
+        km_features_by_type=legacy_features(events, by_type=True),
+        speech=speech,
+        speech_mask=mask,
+    )
+    print(f"Wrote expected.npz: {len(events)} events, {mask.sum()}/{len(mask)} voiced frames")
+
+
+def check():
+    events, audio = read_inputs()
+    expected = np.load(os.path.join(GOLDEN, "expected.npz"))
+    failures = 0
+
+    for key, by_type in (("km_features", False), ("km_features_by_type", True)):
+        for name, fn in (("events", current_features), ("sqlite", current_features_sqlite)):
+            got = fn(events, by_type=by_type)
+            ok = got.dtype == expected[key].dtype and np.array_equal(got, expected[key])
+            failures += not ok
+            print(f"{'OK  ' if ok else 'FAIL'} {key} ({name}): {got.shape} bit-identical={ok}")
+
+    want = expected["speech"]
+    n_frames = int(expected["speech_mask"].sum())
+    n_blocks = -(-sf.info(io.BytesIO(audio)).frames // DECODE_BLOCK_FRAMES)
+    got = load_speech(audio)
+    same_frames = got.shape == want.shape
+    diff = float(np.abs(got - want).max()) if same_frames and len(want) else 0.0
+    ok = same_frames and diff <= SAMPLE_ATOL
+    failures += not ok
+    print(f"{'OK  ' if ok else 'FAIL'} speech ({n_blocks} decode blocks): "
+          f"{len(got) // 480}/{n_frames} voiced frames, max |diff|={diff:.3g}")
+
+    failures += check_runtimes(events)
+
+    if failures:
+        print(f"{failures} golden check(s) failed")
+        sys.exit(1)
+    print("All golden checks passed")
+
+
+if __name__ == "__main__":
+    if "--update" in sys.argv[1:]:
+        update()
+    else:
+        check()
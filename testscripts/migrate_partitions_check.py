@@ -0,0 +1,169 @@
+"""Check migrate_partitions.py against a throwaway PostgreSQL database.
+
+Creates a scratch database, fills plain (pre-partitioning) mouse_events and
+keystroke_events tables spanning several days, then:
+
+- runs every table through a dry run and checks nothing changed,
+- migrates for real and checks the row counts, the partitions, and that the
+  id sequence continues after the highest old id,
+- checks that verify() refuses a copy whose counts differ from the legacy table.
+
+The scratch database is dropped afterwards. The server to use comes from the
+same DB_* variables (or .env) migrate_partitions.py reads; the user needs CREATEDB.
+
+Run from the repository root:
+    python testscripts/migrate_partitions_check.py
+"""
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LOGGER_DIR = os.path.join(HERE, "..", "backend-linux-logger")
+sys.path.insert(0, LOGGER_DIR)
+
+from migrate_partitions import DB_CONFIG, SCHEMA_PATH, migrate, verify
+from partitions import PARTITIONED_TABLES, PartitionManager, is_partitioned
+
+DAYS = 3
+ROWS_PER_DAY = 50
+
+LEGACY_SCHEMA = """
+CREATE TABLE mouse_events (
+    id BIGSERIAL PRIMARY KEY,
+    event_time TIMESTAMP NOT NULL,
+    event_type VARCHAR(20) NOT NULL,
+    x INTEGER,
+    y INTEGER,
+    interval FLOAT,
+    device_fingerprint VARCHAR(64),
+    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX idx_mouse_events_time ON mouse_events (event_time);
+CREATE TABLE keystroke_events (
+    id BIGSERIAL PRIMARY KEY,
+    event_time TIMESTAMP NOT NULL,
+    key_pressed VARCHAR(50) NOT NULL,
+    interval FLOAT,
+    device_fingerprint VARCHAR(64),
+    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX idx_keystroke_events_time ON keystroke_events (event_time);
+"""
+ROWS = {
+    "mouse_events": ("INSERT INTO mouse_events (event_time, event_type, x, y, interval, device_fingerprint) "
+                     "VALUES (%s, 'move', 1, 2, 0.01, 'check')"),
+    "keystroke_events": ("INSERT INTO keystroke_events (event_time, key_pressed, interval, device_fingerprint) "
+                         "VALUES (%s, 'a', 0.01, 'check')"),
+}
+
+
+def server_config(**overrides):
+    config = {k: v for k, v in DB_CONFIG.items() if v is not None}
+    config.update(overrides)
+    return config
+
+
+def fill(conn):
+    start = datetime(2024, 1, 30)
+    times = [(start + timedelta(days=d, minutes=m),) for d in range(DAYS) for m in range(ROWS_PER_DAY)]
+    with conn.cursor() as cur:
+        cur.execute(LEGACY_SCHEMA)
+        for table, insert in ROWS.items():
+            cur.executemany(insert, times)
+            # deleted rows leave a gap, so the sequence has to follow MAX(id), not COUNT(*)
+            cur.execute(sql.SQL("DELETE FROM {} WHERE id = 5").format(sql.Identifier(table)))
+    conn.commit()
+
+
+def snapshot(conn, table):
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("SELECT COUNT(*) AS n, MAX(id) AS max_id FROM {}").format(sql.Identifier(table)))
+        row = cur.fetchone()
+    partitioned = is_partitioned(conn, table)
+    conn.rollback()
+    return row["n"], row["max_id"], partitioned
+
+
+def run_checks(conn, schema):
+    failures = 0
+
+    def report(ok, msg):
+        nonlocal failures
+        failures += not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {msg}")
+
+    before = {table: snapshot(conn, table) for table in PARTITIONED_TABLES}
+
+    partitions = PartitionManager(PARTITIONED_TABLES)
+    for table in PARTITIONED_TABLES:
+        n = migrate(conn, partitions, table, schema, dry_run=True)
+        after = snapshot(conn, table)
+        report(n == before[table][0] and after == before[table],
+               f"{table} dry run: {n} rows verified, table left as {after}")
+
+    partitions = PartitionManager(PARTITIONED_TABLES)
+    for table in PARTITIONED_TABLES:
+        n = migrate(conn, partitions, table, schema, keep_legacy=True)
+        count, max_id, partitioned = snapshot(conn, table)
+        report((count, max_id) == before[table][:2] and partitioned,
+               f"{table} migrated: {count}/{before[table][0]} rows, max id {max_id}, partitioned={partitioned}")
+
+        parts = partitions.partitions(conn, table)
+        conn.rollback()
+        report(len(parts) == DAYS, f"{table}: {len(parts)} daily partitions for {DAYS} days of rows")
+
+        with conn.cursor() as cur:
+            cur.execute(ROWS[table] + " RETURNING id", (datetime(2024, 1, 31, 12),))
+            new_id = cur.fetchone()["id"]
+        conn.rollback()
+        report(new_id > max_id, f"{table}: next id {new_id} follows the highest old id {max_id}")
+
+        legacy = f"{table}_legacy"
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("DELETE FROM {} WHERE id = (SELECT MAX(id) FROM {})").format(
+                sql.Identifier(table), sql.Identifier(table)))
+            try:
+                verify(cur, table, legacy)
+                ok = False
+            except RuntimeError:
+                ok = True
+        conn.rollback()
+        report(ok, f"{table}: verify rejects a copy missing a row")
+
+    return failures
+
+
+def main():
+    with open(SCHEMA_PATH) as f:
+        schema = f.read()
+    dbname = f"migrate_check_{uuid.uuid4().hex[:8]}"
+    admin = psycopg2.connect(**server_config(dbname=DB_CONFIG["dbname"] or "postgres"))
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(dbname)))
+    try:
+        conn = psycopg2.connect(**server_config(dbname=dbname), cursor_factory=RealDictCursor)
+        try:
+            fill(conn)
+            failures = run_checks(conn, schema)
+        finally:
+            conn.close()
+    finally:
+        with admin.cursor() as cur:
+            cur.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(dbname)))
+        admin.close()
+
+    if failures:
+        print(f"{failures} migration check(s) failed")
+        sys.exit(1)
+    print("All migration checks passed")
+
+
+if __name__ == "__main__":
+    main()